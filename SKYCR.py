@@ -1,148 +1,246 @@
 import customtkinter as ctk
 import threading
-import requests
-import json
-import os
-import urllib3
-import time
-from concurrent.futures import ThreadPoolExecutor
-from threading import Lock
-from typing import Dict, List, Optional, Tuple
+from bisect import bisect_left, insort
+from collections import deque
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
 import logging
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+from runner import (DEFAULT_USER_AGENT, FILES, LOG_PREFIXES, QUEST_SNAPSHOTS, TRANSPORTS, ConfigManager, JobScheduler,
+                    ProfileScheduler, RunJournal, StoreError, open_store)
 
-# Constants
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-FILES = {
-    'pickup': os.path.join(BASE_DIR, "pickup_data.json"),
-    'users': os.path.join(BASE_DIR, "users.json"),
-    'questname': os.path.join(BASE_DIR, "questname.json"),
-    'collectible': os.path.join(BASE_DIR, "claimquest.json"),
-    'targets': os.path.join(BASE_DIR, "targets.json"),
-    'config': os.path.join(BASE_DIR, "config.json")
-}
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-DEFAULT_USER_AGENT = 'Sky-Live-com.tgc.sky.win/0.28.1.310103 (To Be Filled By O.E.M.; win 10.0.22621; en)'
-BASE_URL = 'https://live.radiance.thatgamecompany.com'
+LOG_COLORS = {"error": "red", "success": "yellow", "info": "white", "warning": "orange"}
+LOG_FRAME_MS = 50
+LOG_MAX_LINES = 2000
+METRICS_REFRESH_MS = 1000
+LIST_ROW_HEIGHT = 28
+LIST_SELECTED_COLOR = "#2f6f3f"
 
-class ConfigManager:
-    @staticmethod
-    def load_config() -> Dict:
-        default = {
-            'user_agent': DEFAULT_USER_AGENT,
-            'max_workers': 10,
-            'request_timeout': 10,
-            'max_retries': 3
-        }
-        if not os.path.exists(FILES['config']):
-            ConfigManager.save_config(default)
-            return default
-        try:
-            with open(FILES['config'], 'r', encoding='utf-8') as f:
-                return {**default, **json.load(f)}
-        except:
-            return default
+class LogSink:
+    # Lock-free hand-off from worker threads to the Tk thread: push() is a deque append (oldest pending
+    # lines fall off past `maxlen`), progress is a single tuple swap, and the GUI drains once per frame.
+    def __init__(self, maxlen: int = LOG_MAX_LINES):
+        self._pending = deque(maxlen=maxlen)
+        self.progress: Optional[Tuple[int, int]] = None
     
-    @staticmethod
-    def save_config(config: Dict) -> bool:
+    def push(self, text: str, lvl: str):
+        self._pending.append((text, lvl))
+    
+    def set_progress(self, done: int, total: int):
+        self.progress = (done, total)
+    
+    def drain(self) -> List[Tuple[str, str]]:
+        out = []
         try:
-            with open(FILES['config'], 'w', encoding='utf-8') as f:
-                json.dump(config, f, indent=4)
-            return True
-        except:
-            return False
+            while True:
+                out.append(self._pending.popleft())
+        except IndexError:
+            return out
 
-class SkyAPIClient:
-    def __init__(self, session_id: str, user_id: str, config: Dict):
-        self.session_id = session_id
-        self.user_id = user_id
-        self.config = config
-        self.session = requests.Session()
-        self.session.verify = False
-        
-    def _get_headers(self) -> Dict[str, str]:
-        return {
-            'Host': 'live.radiance.thatgamecompany.com',
-            'Accept': '*/*',
-            'Content-Type': 'application/json',
-            'session': self.session_id,
-            'user': self.user_id,
-            'User-Agent': self.config['user_agent'],
-            'user-id': self.user_id
-        }
-    
-    def _make_request(self, endpoint: str, data: Dict, req_type: str, name: str) -> Tuple[str, Optional[str]]:
-        url = f"{BASE_URL}{endpoint}"
-        for attempt in range(1, self.config['max_retries'] + 1):
-            try:
-                resp = self.session.post(url, headers=self._get_headers(), json=data, timeout=self.config['request_timeout'])
-                if resp.status_code == 200:
-                    return "success", resp.json().get("result", "Success")
-                elif resp.status_code == 401:
-                    return "fail", "Unauthorized"
-                elif attempt == self.config['max_retries']:
-                    return "fail", f"HTTP {resp.status_code}"
-            except requests.exceptions.Timeout:
-                logging.warning(f"Timeout {req_type} {name} attempt {attempt}")
-            except Exception as e:
-                logging.error(f"Error {req_type} {name}: {e}")
-            if attempt < self.config['max_retries']:
-                time.sleep(2 ** attempt)
-        return "fail", "Max retries"
-    
-    def collect_pickup_batch(self, level_id: str, pickup_ids: List):
-        data = {"emitters": [], "global_pickup_ids": [], "level_id": level_id, "pickup_ids": pickup_ids,
-                "session": self.session_id, "user": self.user_id, "user_id": self.user_id}
-        return self._make_request("/account/collect_pickup_batch", data, "Level", level_id)
-    
-    def get_account_world_quests(self):
-        data = {"session": self.session_id, "user": self.user_id, "user_id": self.user_id}
-        return self._make_request("/account/get_account_world_quests", data, "Pre", "Pre")
-    
-    def claim_quest_reward(self, name: str):
-        data = {"bonus_percent": 0, "name": name, "session": self.session_id, "user": self.user_id, "user_id": self.user_id}
-        return self._make_request("/account/claim_quest_reward", data, "Quest", name)
-    
-    def collect_collectible(self, name: str):
-        data = {"carrying": False, "name": name, "session": self.session_id, "user": self.user_id, "user_id": self.user_id}
-        return self._make_request("/account/collect_collectible", data, "Collectible", name)
-    
-    def send_light(self, target_id: str, target_name: str):
-        data = {"gift_type": "gift_heart_wax", "session": self.session_id, "target": target_id,
-                "user": self.user_id, "user_id": self.user_id}
-        return self._make_request("/service/relationship/api/v1/free_gifts/send", data, "Light", target_name)
-    
-    def send_heart(self, target_id: str, target_name: str):
-        data = {"gift_type": "gift", "session": self.session_id, "target": target_id,
-                "user": self.user_id, "user_id": self.user_id}
-        return self._make_request("/account/send_message", data, "Heart", target_name)
-    
-    def close(self):
-        self.session.close()
-
-class FileManager:
-    @staticmethod
-    def load_json(path: str, default=None):
-        if default is None:
-            default = []
-        if not os.path.exists(path):
-            return default
-        try:
-            with open(path, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except:
-            return default
+class PrefixIndex:
+    # Sorted (term, key) pairs over each item's fields and the words in them: a prefix lookup is one
+    # bisect plus a walk over the matching run, and add/remove only touch the item's own terms.
+    def __init__(self):
+        self._terms: List[Tuple[str, str]] = []
     
     @staticmethod
-    def save_json(path: str, data):
-        try:
-            with open(path, 'w', encoding='utf-8') as f:
-                json.dump(data, f, indent=4, ensure_ascii=False)
-            return True
-        except:
-            return False
+    def terms(texts: Iterable[str]) -> Set[str]:
+        out = set()
+        for text in texts:
+            text = str(text).lower()
+            out.add(text)
+            out.update(text.split())
+        return out
+    
+    def rebuild(self, entries: Iterable[Tuple[str, Iterable[str]]]):
+        self._terms = sorted((t, key) for key, texts in entries for t in self.terms(texts))
+    
+    def add(self, key: str, texts: Iterable[str]):
+        for t in self.terms(texts):
+            insort(self._terms, (t, key))
+    
+    def remove(self, key: str, texts: Iterable[str]):
+        for t in self.terms(texts):
+            i = bisect_left(self._terms, (t, key))
+            if i < len(self._terms) and self._terms[i] == (t, key):
+                del self._terms[i]
+    
+    def search(self, prefix: str) -> Set[str]:
+        prefix = prefix.lower()
+        out = set()
+        i = bisect_left(self._terms, (prefix, ""))
+        while i < len(self._terms) and self._terms[i][0].startswith(prefix):
+            out.add(self._terms[i][1])
+            i += 1
+        return out
+
+class VirtualList(ctk.CTkFrame):
+    # A fixed pool of `rows` row widgets over an arbitrarily long item list: scrolling, filtering and
+    # edits only reconfigure the visible rows. Items are dicts keyed by item[key_field]; `selected` is
+    # a set of keys. multi=True renders checkboxes, otherwise single-select buttons.
+    def __init__(self, parent, rows: int, label: Callable[[Dict], str], search_fields: Tuple[str, ...],
+                 key_field: str = 'user_id', multi: bool = False,
+                 on_select: Optional[Callable[[Dict], None]] = None, width: int = 300):
+        super().__init__(parent)
+        self.label = label
+        self.search_fields = search_fields
+        self.key_field = key_field
+        self.multi = multi
+        self.on_select = on_select
+        self.items: Dict[str, Dict] = {}
+        self.order: List[str] = []
+        self.view: List[str] = []
+        self.selected: Set[str] = set()
+        self.index = PrefixIndex()
+        self.query: List[str] = []
+        self.offset = 0
+        
+        top = ctk.CTkFrame(self, fg_color="transparent")
+        top.pack(fill="x")
+        self.filter = ctk.CTkEntry(top, placeholder_text="Filter by name or ID", width=width - 90)
+        self.filter.pack(side="left", padx=2, pady=2)
+        self.filter.bind("<KeyRelease>", lambda e: self.set_filter(self.filter.get()))
+        self.count = ctk.CTkLabel(top, text="", width=80, text_color="gray")
+        self.count.pack(side="right", padx=2)
+        
+        body = ctk.CTkFrame(self, fg_color="transparent")
+        body.pack(fill="x")
+        self.scroll = ctk.CTkScrollbar(body, command=self._on_scroll, height=rows * LIST_ROW_HEIGHT)
+        self.scroll.pack(side="right", fill="y")
+        grid = ctk.CTkFrame(body, fg_color="transparent", width=width, height=rows * LIST_ROW_HEIGHT)
+        grid.pack(side="left", fill="both", expand=True)
+        grid.grid_columnconfigure(0, weight=1)
+        self.rows: List[Tuple] = []
+        for i in range(rows):
+            if multi:
+                var = ctk.BooleanVar(value=False)
+                w = ctk.CTkCheckBox(grid, text="", variable=var, command=lambda i=i: self._toggle(i))
+            else:
+                var = None
+                w = ctk.CTkButton(grid, text="", command=lambda i=i: self._select(i))
+            self.rows.append((w, var))
+        self._default_color = None if multi else self.rows[0][0].cget("fg_color")
+        self._shown: List[Optional[Tuple[str, bool]]] = [None] * rows
+        for w in [grid] + [w for w, _ in self.rows]:
+            for seq in ("<MouseWheel>", "<Button-4>", "<Button-5>"):
+                w.bind(seq, self._on_wheel)
+    
+    def _texts(self, item: Dict) -> List[str]:
+        return [item.get(f, "") for f in self.search_fields]
+    
+    def set_items(self, items: Iterable[Dict]):
+        self.items = {}
+        for it in items:
+            if isinstance(it, dict) and it.get(self.key_field):
+                self.items.setdefault(it[self.key_field], it)
+        self.order = list(self.items)
+        self.index.rebuild((k, self._texts(it)) for k, it in self.items.items())
+        self.selected &= set(self.items)
+        self._refilter()
+    
+    def add(self, item: Dict):
+        key = item[self.key_field]
+        self.items[key] = item
+        self.order.append(key)
+        self.index.add(key, self._texts(item))
+        if self._matches(item):
+            self.view.append(key)
+        self._render()
+    
+    def remove(self, keys: Iterable[str]):
+        keys = {k for k in keys if k in self.items}
+        for k in keys:
+            self.index.remove(k, self._texts(self.items.pop(k)))
+        self.order = [k for k in self.order if k not in keys]
+        self.view = [k for k in self.view if k not in keys]
+        self.selected -= keys
+        self._render()
+    
+    def selection(self) -> List[Dict]:
+        return [self.items[k] for k in self.order if k in self.selected]
+    
+    def selected_item(self) -> Optional[Dict]:
+        return next((self.items[k] for k in self.selected if k in self.items), None)
+    
+    def set_filter(self, text: str):
+        query = text.lower().split()
+        if query != self.query:
+            self.query = query
+            self.offset = 0
+            self._refilter()
+    
+    def _matches(self, item: Dict) -> bool:
+        terms = PrefixIndex.terms(self._texts(item))
+        return all(any(t.startswith(w) for t in terms) for w in self.query)
+    
+    def _refilter(self):
+        if not self.query:
+            self.view = list(self.order)
+        else:
+            hits = self.index.search(self.query[0])
+            for w in self.query[1:]:
+                hits &= self.index.search(w)
+            self.view = [k for k in self.order if k in hits]
+        self._render()
+    
+    def _render(self):
+        n = len(self.rows)
+        total = len(self.view)
+        self.offset = max(0, min(self.offset, total - n))
+        for i, (w, var) in enumerate(self.rows):
+            j = self.offset + i
+            if j >= total:
+                if self._shown[i] is not None:
+                    w.grid_remove()
+                    self._shown[i] = None
+                continue
+            key = self.view[j]
+            state = (self.label(self.items[key]), key in self.selected)
+            if state != self._shown[i]:
+                if self.multi:
+                    var.set(state[1])
+                    w.configure(text=state[0])
+                else:
+                    w.configure(text=state[0], fg_color=LIST_SELECTED_COLOR if state[1] else self._default_color)
+                if self._shown[i] is None:
+                    w.grid(row=i, column=0, sticky="ew", pady=2)
+                self._shown[i] = state
+        self.scroll.set(self.offset / total if total else 0.0, min(1.0, (self.offset + n) / total) if total else 1.0)
+        self._update_count()
+    
+    def _update_count(self):
+        if self.multi:
+            self.count.configure(text=f"{len(self.selected)} selected")
+        else:
+            self.count.configure(text=f"{len(self.view)}/{len(self.items)}")
+    
+    def _on_scroll(self, *args):
+        if args[0] == "moveto":
+            self.offset = int(float(args[1]) * len(self.view))
+        elif args[0] == "scroll":
+            self.offset += int(float(args[1])) * (len(self.rows) if args[2] == "pages" else 1)
+        self._render()
+    
+    def _on_wheel(self, event):
+        self._on_scroll("scroll", -1 if event.num == 4 or event.delta > 0 else 1, "units")
+    
+    def _toggle(self, i: int):
+        key = self.view[self.offset + i]
+        w, var = self.rows[i]
+        if var.get():
+            self.selected.add(key)
+        else:
+            self.selected.discard(key)
+        self._shown[i] = (self._shown[i][0], var.get())
+        self._update_count()
+    
+    def _select(self, i: int):
+        key = self.view[self.offset + i]
+        self.selected = {key}
+        self._render()
+        if self.on_select:
+            self.on_select(self.items[key])
 
 class SettingsWindow:
     def __init__(self, parent, config: Dict, callback):
@@ -178,6 +276,8 @@ class SettingsWindow:
         self.workers.pack(side="left", padx=5)
         self.workers.insert(0, str(config['max_workers']))
         ctk.CTkLabel(w_frame, text="(1-20)", text_color="gray").pack(side="left")
+        self.adaptive = ctk.BooleanVar(value=bool(config.get('adaptive_concurrency')))
+        ctk.CTkCheckBox(w_frame, text="Adaptive (max is the ceiling)", variable=self.adaptive).pack(side="left", padx=10)
         
         # Timeout
         t_frame = ctk.CTkFrame(adv_frame)
@@ -209,6 +309,7 @@ class SettingsWindow:
         self.ua_entry.insert("1.0", DEFAULT_USER_AGENT)
         self.workers.delete(0, "end")
         self.workers.insert(0, "10")
+        self.adaptive.set(True)
         self.timeout.delete(0, "end")
         self.timeout.insert(0, "10")
         self.retries.delete(0, "end")
@@ -229,7 +330,8 @@ class SettingsWindow:
             if not 1 <= retries <= 10:
                 raise ValueError("Max Retries: 1-10")
             
-            self.config.update({'user_agent': ua, 'max_workers': workers, 'request_timeout': timeout, 'max_retries': retries})
+            self.config.update({'user_agent': ua, 'max_workers': workers, 'request_timeout': timeout, 'max_retries': retries,
+                                'adaptive_concurrency': self.adaptive.get()})
             if ConfigManager.save_config(self.config):
                 self.callback(self.config)
                 self.win.destroy()
@@ -239,10 +341,11 @@ class SettingsWindow:
 class SkyAutomationGUI:
     def __init__(self):
         self.users, self.targets = [], []
-        self.selected_user_index = None
-        self.target_vars = {}
-        self.log_lock = Lock()
+        self.sink = LogSink()
         self.config = ConfigManager.load_config()
+        self.journal = RunJournal(FILES['journal'], self.config['journal_ttl_hours'])
+        self.store = open_store(self.config)
+        self.jobs = JobScheduler(self.config, self.journal, log=self._log, progress=self._update_progress)
         self._init_gui()
         self._load_data()
     
@@ -260,7 +363,9 @@ class SkyAutomationGUI:
         ctk.CTkButton(menu, text="⚙️ Settings", command=self._open_settings, width=100, fg_color="transparent", border_width=1).pack(side="right", padx=5)
         
         # Users
-        self.user_list = ctk.CTkScrollableFrame(self.root, width=300, height=150)
+        self.user_list = VirtualList(self.root, rows=5, label=lambda u: f"{u['nickname']} | ...{u['user_id'][-4:]}",
+                                     search_fields=('nickname', 'user_id'),
+                                     on_select=lambda u: self._log(f"Selected: {u['nickname']}", "info"))
         self.user_list.pack(pady=5)
         
         inp = ctk.CTkFrame(self.root)
@@ -284,6 +389,10 @@ class SkyAutomationGUI:
         ctk.CTkButton(act, text="Start CR", command=self._start_cr).pack(side="left", padx=5)
         ctk.CTkButton(act, text="Start World Quest", command=self._start_quest).pack(side="left", padx=5)
         ctk.CTkButton(self.root, text="Send Light & Heart", command=self._start_gifts).pack(pady=5)
+        batch = ctk.CTkFrame(self.root)
+        batch.pack(pady=5)
+        ctk.CTkButton(batch, text="CR: All Profiles", command=lambda: self._start_batch("cr")).pack(side="left", padx=5)
+        ctk.CTkButton(batch, text="Quests: All Profiles", command=lambda: self._start_batch("quest")).pack(side="left", padx=5)
         
         # Targets
         tgt = ctk.CTkFrame(self.root)
@@ -300,51 +409,113 @@ class SkyAutomationGUI:
         ctk.CTkButton(tbtn, text="Add Target", command=self._add_target).pack(side="left", padx=5)
         ctk.CTkButton(tbtn, text="Delete Selected", command=self._delete_targets).pack(side="left", padx=5)
         
-        self.tlist = ctk.CTkScrollableFrame(tgt, width=300, height=100)
-        self.tlist.pack(pady=5)
+        self.target_list = VirtualList(tgt, rows=4, label=lambda t: f"{t['name']} | ...{t['user_id'][-4:]}",
+                                       search_fields=('name', 'user_id'), multi=True)
+        self.target_list.pack(pady=5)
         
         # Log
         self.log = ctk.CTkTextbox(self.root, width=400, height=150)
         self.log.pack(pady=5)
-        ctk.CTkButton(self.root, text="Clear Log", command=lambda: self.log.delete("1.0", "end")).pack(pady=5)
+        for lvl, color in LOG_COLORS.items():
+            self.log.tag_config(lvl, foreground=color)
+        log_btn = ctk.CTkFrame(self.root)
+        log_btn.pack(pady=5)
+        ctk.CTkButton(log_btn, text="Clear Log", command=lambda: self.log.delete("1.0", "end")).pack(side="left", padx=5)
+        ctk.CTkButton(log_btn, text="Cancel Jobs", command=self._cancel_jobs).pack(side="left", padx=5)
+        ctk.CTkButton(log_btn, text="Reset Journal", command=self._reset_journal).pack(side="left", padx=5)
         
         # Progress
         self.progress = ctk.CTkProgressBar(self.root, width=400)
         self.progress.pack(pady=5)
         self.progress.set(0)
-        self.prog_count = self.prog_total = 0
+        self._shown_progress = None
+        self.root.after(LOG_FRAME_MS, self._flush_sink)
         
         # Status
         self.status = ctk.CTkLabel(self.root, text=f"UA: {self.config['user_agent'][:40]}...", text_color="gray", font=ctk.CTkFont(size=9))
         self.status.pack(pady=(0,5))
+        self.jobs_label = ctk.CTkLabel(self.root, text="", text_color="gray", font=ctk.CTkFont(size=9))
+        self.jobs_label.pack(pady=(0,5))
+        
+        # Live metrics (config: metrics_panel)
+        self.metrics_panel = ctk.CTkLabel(self.root, text="", justify="left", anchor="w", font=ctk.CTkFont(family="Courier", size=9))
+        self._metrics_shown = False
+        self.root.after(METRICS_REFRESH_MS, self._refresh_metrics)
     
     def _open_settings(self):
         SettingsWindow(self.root, self.config, self._on_config_saved)
     
     def _on_config_saved(self, cfg):
-        self.config = cfg
+        self.config = self.jobs.config = cfg
         self._log("Settings saved", "success")
         self.status.configure(text=f"UA: {cfg['user_agent'][:40]}...")
     
     def _log(self, msg: str, lvl="info"):
-        with self.log_lock:
-            colors = {"error": "red", "success": "yellow", "info": "white", "warning": "orange"}
-            prefixes = {"error": "[ERROR]", "success": "[✓]", "info": "[i]", "warning": "[!]"}
-            text = f"{prefixes.get(lvl, '[i]')} {msg}\n"
-            self.root.after(0, lambda: (self.log.insert("end", text), self.log.tag_config(lvl, foreground=colors.get(lvl, "white")), self.log.see("end")))
-    
-    def _update_progress(self, inc=True):
-        if inc and self.prog_total > 0:
-            self.prog_count += 1
-            self.root.after(0, lambda: self.progress.set(self.prog_count / self.prog_total))
-        else:
-            self.root.after(0, lambda: self.progress.set(0))
+        self.sink.push(f"{LOG_PREFIXES.get(lvl, '[i]')} {msg}\n", lvl)
+    
+    def _update_progress(self, done: int, total: int):
+        self.sink.set_progress(done, total)
+    
+    def _refresh_metrics(self):
+        runner = self.jobs.last_runner
+        show = bool(self.config.get('metrics_panel')) and runner is not None and runner.metrics is not None
+        if show != self._metrics_shown:
+            self.metrics_panel.pack(pady=(0,5), fill="x", padx=10) if show else self.metrics_panel.pack_forget()
+            self._metrics_shown = show
+        if show:
+            rows = runner.metrics.summary()
+            lines = [f"{'endpoint':<24}{'calls':>6}{'retry':>6}{'p50':>7}{'p95':>7}{'queue95':>8}"]
+            lines += [f"{r['endpoint'].rsplit('/', 1)[-1][:23]:<24}{r['calls']:>6}{r['retries']:>6}"
+                      f"{r['wall_p50_ms']:>7.0f}{r['wall_p95_ms']:>7.0f}{r['queue_p95_ms']:>8.0f}" for r in rows]
+            lines.append(f"in flight: {runner.metrics.in_flight} (peak {runner.metrics.peak_in_flight})")
+            self.metrics_panel.configure(text="\n".join(lines))
+        lim = runner.limiter if runner else None
+        status = f"UA: {self.config['user_agent'][:40]}..." + (f" | concurrency {lim.current}/{lim.ceiling}" if lim else "")
+        if status != self.status.cget("text"):
+            self.status.configure(text=status)
+        jobs = " | ".join(f"{j.name}: {j.state}" + (f" {j.progress[0]}/{j.progress[1]}" if j.progress[1] else "")
+                          for j in self.jobs.jobs())
+        if jobs != self.jobs_label.cget("text"):
+            self.jobs_label.configure(text=jobs)
+        self.root.after(METRICS_REFRESH_MS, self._refresh_metrics)
+    
+    def _flush_sink(self):
+        # One batched insert per run of same-level lines, then trim the textbox to LOG_MAX_LINES
+        lines = self.sink.drain()
+        if lines:
+            start = 0
+            for i in range(1, len(lines) + 1):
+                if i == len(lines) or lines[i][1] != lines[start][1]:
+                    self.log.insert("end", "".join(t for t, _ in lines[start:i]), lines[start][1])
+                    start = i
+            excess = int(self.log.index("end-1c").split(".")[0]) - LOG_MAX_LINES
+            if excess > 0:
+                self.log.delete("1.0", f"{excess + 1}.0")
+            self.log.see("end")
+        prog = self.sink.progress
+        if prog is not None and prog != self._shown_progress:
+            self._shown_progress = done, total = prog
+            self.progress.set(done / total if total > 0 else 0)
+        self.root.after(LOG_FRAME_MS, self._flush_sink)
+    
+    def _reset_journal(self):
+        # Resets only the selected user's entries; with no user selected the whole journal is cleared
+        user = self.user_list.selected_item()
+        n = self.journal.reset(user['user_id'] if user else None)
+        QUEST_SNAPSHOTS.drop(user['user_id'] if user else None)
+        self._log(f"Journal reset: {n} entr{'y' if n == 1 else 'ies'} removed", "success")
     
     def _load_data(self):
-        self.users = FileManager.load_json(FILES['users'], [])
-        self.targets = FileManager.load_json(FILES['targets'], [])
-        self._display_users()
-        self._display_targets()
+        for err in self.store.errors:
+            self._log(err, "error")
+        for attr in ("users", "targets"):
+            try:
+                setattr(self, attr, getattr(self.store, attr).load())
+            except StoreError as e:
+                setattr(self, attr, [])
+                self._log(f"Cannot load {attr}: {e}", "error")
+        self.user_list.set_items(u for u in self.users if isinstance(u, dict) and 'nickname' in u)
+        self.target_list.set_items(self.targets)
     
     def _validate(self):
         try:
@@ -359,10 +530,11 @@ class SkyAutomationGUI:
         if not sid:
             self._log("Session ID required", "error")
             return None, None
-        if self.selected_user_index is None or self.selected_user_index >= len(self.users):
+        user = self.user_list.selected_item()
+        if not user:
             self._log("Select a user", "error")
             return None, None
-        return sid, self.users[self.selected_user_index]
+        return sid, user
     
     def _add_user(self):
         nick = self.nick.get().strip()
@@ -370,32 +542,30 @@ class SkyAutomationGUI:
         if not nick or not uid:
             self._log("Nickname and User ID required", "error")
             return
-        self.users.append({"nickname": nick, "user_id": uid})
-        if FileManager.save_json(FILES['users'], self.users):
+        if uid in self.user_list.items:
+            self._log(f"User ID already listed as '{self.user_list.items[uid]['nickname']}'", "error")
+            return
+        user = {"nickname": nick, "user_id": uid}
+        if not self.store.users.add(user):
+            self._log(f"Could not save user '{nick}'", "error")
+        else:
+            self.users.append(user)
             self._log(f"User '{nick}' added", "success")
-            self._display_users()
+            self.user_list.add(user)
             self.nick.delete(0, "end")
             self.uid.delete(0, "end")
     
     def _delete_user(self):
-        if self.selected_user_index is None:
+        user = self.user_list.selected_item()
+        if not user:
             self._log("No user selected", "error")
             return
-        user = self.users.pop(self.selected_user_index)
-        if FileManager.save_json(FILES['users'], self.users):
+        if not self.store.users.remove([user['user_id']]):
+            self._log(f"Could not delete user '{user['nickname']}'", "error")
+        else:
+            self.users = [u for u in self.users if u.get('user_id') != user['user_id']]
             self._log(f"User '{user['nickname']}' deleted", "success")
-            self.selected_user_index = None
-            self._display_users()
-    
-    def _display_users(self):
-        for w in self.user_list.winfo_children():
-            w.destroy()
-        for idx, u in enumerate(self.users):
-            if not isinstance(u, dict) or 'nickname' not in u:
-                continue
-            def cb(i=idx, user=u):
-                return lambda: (setattr(self, 'selected_user_index', i), self._log(f"Selected: {user['nickname']}", "info"))
-            ctk.CTkButton(self.user_list, text=f"{u['nickname']} | ...{u['user_id'][-4:]}", command=cb()).pack(fill="x", pady=2)
+            self.user_list.remove([user['user_id']])
     
     def _add_target(self):
         name = self.tname.get().strip()
@@ -403,138 +573,79 @@ class SkyAutomationGUI:
         if not name or not tid:
             self._log("Target name and ID required", "error")
             return
-        self.targets.append({"name": name, "user_id": tid})
-        if FileManager.save_json(FILES['targets'], self.targets):
+        if tid in self.target_list.items:
+            self._log(f"Target ID already listed as '{self.target_list.items[tid]['name']}'", "error")
+            return
+        target = {"name": name, "user_id": tid}
+        if not self.store.targets.add(target):
+            self._log(f"Could not save target '{name}'", "error")
+        else:
+            self.targets.append(target)
             self._log(f"Target '{name}' added", "success")
-            self._display_targets()
+            self.target_list.add(target)
             self.tname.delete(0, "end")
             self.tid.delete(0, "end")
     
     def _delete_targets(self):
-        sel = [t for t in self.targets if self.target_vars.get(t['user_id'], ctk.BooleanVar()).get()]
+        sel = set(self.target_list.selected)
         if not sel:
             self._log("No targets selected", "error")
             return
-        for t in sel:
-            self.targets.remove(t)
-        if FileManager.save_json(FILES['targets'], self.targets):
+        if not self.store.targets.remove(sel):
+            self._log("Could not delete the selected targets", "error")
+        else:
+            self.targets = [t for t in self.targets if t.get('user_id') not in sel]
             self._log(f"Deleted {len(sel)} target(s)", "success")
-            self._display_targets()
-    
-    def _display_targets(self):
-        for w in self.tlist.winfo_children():
-            w.destroy()
-        self.target_vars.clear()
-        for t in self.targets:
-            var = ctk.BooleanVar(value=False)
-            self.target_vars[t['user_id']] = var
-            ctk.CTkCheckBox(self.tlist, text=f"{t['name']} | ...{t['user_id'][-4:]}", variable=var).pack(fill="x", pady=2)
+            self.target_list.remove(sel)
     
     def _start_cr(self):
         sid, user = self._validate()
         if not sid or not user:
             return
-        threading.Thread(target=self._process_cr, args=(sid, user['user_id']), daemon=True).start()
-    
-    def _process_cr(self, sid, uid):
-        self.log.delete("1.0", "end")
-        self._log("Starting CR...", "info")
-        if not os.path.exists(FILES['pickup']):
-            self._log("pickup_data.json not found", "error")
-            return
-        
-        client = SkyAPIClient(sid, uid, self.config)
-        try:
-            with open(FILES['pickup'], 'r', encoding='utf-8') as f:
-                lines = [l.strip() for l in f if l.strip()]
-            self.prog_count = 0
-            self.prog_total = len(lines)
-            self._update_progress(inc=False)
-            
-            def proc(line):
-                try:
-                    data = json.loads(line)
-                    lid = data.get("level_id")
-                    pids = data.get("pickup_ids")
-                    if lid and pids:
-                        st, res = client.collect_pickup_batch(lid, pids)
-                        self._log(f"Level {lid}: {res}", "success" if st == "success" else "error")
-                        self._update_progress()
-                except Exception as e:
-                    self._log(f"Error: {e}", "error")
-            
-            with ThreadPoolExecutor(max_workers=self.config['max_workers']) as ex:
-                list(ex.map(proc, lines))
-            self._log("CR complete", "success")
-        except Exception as e:
-            self._log(f"CR error: {e}", "error")
-        finally:
-            client.close()
+        self.jobs.submit("cr", sid, user['user_id'], label=user['nickname'])
     
     def _start_quest(self):
         sid, user = self._validate()
         if not sid or not user:
             return
-        threading.Thread(target=self._process_quest, args=(sid, user['user_id']), daemon=True).start()
-    
-    def _process_quest(self, sid, uid):
-        self.log.delete("1.0", "end")
-        self._log("Starting quests...", "info")
-        quests = FileManager.load_json(FILES['questname'], [])
-        collectibles = FileManager.load_json(FILES['collectible'], [])
-        if not quests and not collectibles:
-            self._log("No quests/collectibles", "error")
-            return
-        
-        client = SkyAPIClient(sid, uid, self.config)
-        try:
-            st, res = client.get_account_world_quests()
-            if st != "success":
-                self._log("Pre-process failed", "error")
-                return
-            self._log("Pre-process OK", "success")
-            
-            for q in quests:
-                st, res = client.claim_quest_reward(q)
-                self._log(f"Quest '{q}': {res}", "success" if st == "success" else "error")
-            
-            for c in collectibles:
-                st, res = client.collect_collectible(c)
-                self._log(f"Collectible '{c}': {res}", "success" if st == "success" else "error")
-            
-            self._log("Quest/collectible complete", "success")
-        except Exception as e:
-            self._log(f"Quest error: {e}", "error")
-        finally:
-            client.close()
+        self.jobs.submit("quest", sid, user['user_id'], label=user['nickname'])
     
     def _start_gifts(self):
         sid, user = self._validate()
         if not sid or not user:
             return
-        sel = [t for t in self.targets if self.target_vars.get(t['user_id'], ctk.BooleanVar()).get()]
+        sel = self.target_list.selection()
         if not sel:
             self._log("No targets selected", "error")
             return
-        threading.Thread(target=self._process_gifts, args=(sid, user['user_id'], sel), daemon=True).start()
+        self.jobs.submit("gifts", sid, user['user_id'], (sel,), label=user['nickname'])
     
-    def _process_gifts(self, sid, uid, targets):
-        self.log.delete("1.0", "end")
-        self._log("Sending gifts...", "info")
-        client = SkyAPIClient(sid, uid, self.config)
-        try:
-            for t in targets:
-                st, res = client.send_light(t['user_id'], t['name'])
-                self._log(f"Light to {t['name']}: {res}", "success" if st == "success" else "error")
-                st, res = client.send_heart(t['user_id'], t['name'])
-                self._log(f"Heart to {t['name']}: {res}", "success" if st == "success" else "error")
-            self._log("Gifts sent", "success")
-        except Exception as e:
-            self._log(f"Gift error: {e}", "error")
-        finally:
-            client.close()
+    def _start_batch(self, kind):
+        if not self.users:
+            self._log("No profiles", "error")
+            return
+        profiles = [dict(u) for u in self.users if isinstance(u, dict) and u.get('user_id')]
+        # The session box stands in for the selected profile when users.json holds no session for it
+        sid = self.session.get().strip()
+        user = self.user_list.selected_item()
+        if sid and user:
+            for p in profiles:
+                if p['user_id'] == user['user_id']:
+                    p.setdefault('session', sid)
+        threading.Thread(target=self._process_batch, args=(kind, profiles), daemon=True).start()
+    
+    def _process_batch(self, kind, profiles):
+        # Blocks until every profile's job settles, so it stays off the Tk thread
+        ProfileScheduler(self.config, self.journal, log=self._log, jobs=self.jobs).run(kind, profiles)
+    
+    def _cancel_jobs(self):
+        n = self.jobs.cancel_all()
+        self._log(f"Cancelling {n} job(s)" if n else "No jobs to cancel", "warning" if n else "info")
     
     def _on_closing(self):
+        self.jobs.cancel_all()
+        self.store.close()
+        TRANSPORTS.close_all()
         self.root.destroy()
     
     def run(self):
@@ -0,0 +1,101 @@
+import asyncio
+import logging
+import time
+import threading
+from concurrent.futures import Future
+from typing import Dict, Optional, Tuple
+
+from runner import CallStats, CircuitOpen, SkyAPIClient
+
+class AsyncSkyAPIClient(SkyAPIClient):
+    # Same endpoint methods as SkyAPIClient, but they return coroutines that run on one private event
+    # loop; submit() hands them to that loop from any thread and returns a concurrent Future.
+    owns_loop = True
+    
+    def __init__(self, session_id: str, user_id: str, config: Dict):
+        import aiohttp
+        self._aiohttp = aiohttp
+        self.session_id = session_id
+        self.user_id = user_id
+        self.start_run(config)
+        self.pool_size = max(1, int(config['max_in_flight']))
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="sky-async", daemon=True)
+        self._thread.start()
+        self.session = asyncio.run_coroutine_threadsafe(self._open(), self.loop).result()
+    
+    def start_run(self, config: Dict):
+        super().start_run(config)
+        # Passed per request rather than to the session, which TransportManager keeps across runs
+        self._timeout = self._aiohttp.ClientTimeout(total=config['request_timeout'])
+    
+    async def _open(self):
+        self._window = asyncio.Semaphore(self.pool_size)
+        connector = self._aiohttp.TCPConnector(limit=self.pool_size, ssl=False, keepalive_timeout=30)
+        return self._aiohttp.ClientSession(connector=connector)
+    
+    async def _make_request(self, endpoint: str, body: bytes, req_type: str, name: str, whole: bool = False) -> Tuple[str, Optional[str]]:
+        url = f"{self.config['base_url']}{endpoint}"
+        budget = self.retry.budget(endpoint)
+        # Queue wait here is the time spent waiting for a max_in_flight slot
+        call = CallStats()
+        while True:
+            t0 = time.perf_counter()
+            st, res, retry_after = await self._send(url, body, req_type, name, call)
+            if self.feedback:
+                self.feedback(call.status, time.perf_counter() - t0)
+            if st != "retry" or call.attempts >= budget:
+                self.metrics.record(endpoint, call)
+                if st == "success" and not whole:
+                    res = res.get("result", "Success")
+                return ("fail" if st == "retry" else st), res
+            # Backoff only suspends this coroutine; the in-flight slot is already released
+            await asyncio.sleep(self.retry.delay(call.attempts, retry_after))
+    
+    async def _send(self, url: str, body: bytes, req_type: str, name: str, call: CallStats) -> Tuple[str, Optional[str], Optional[str]]:
+        try:
+            async with self._window:
+                # Checked after acquiring a slot so calls queued behind the window fail fast too
+                self.breaker.check()
+                if call.started is None:
+                    call.started = time.perf_counter()
+                call.attempts += 1
+                self.metrics.enter()
+                try:
+                    async with self.session.post(url, headers=self._get_headers(), data=body, timeout=self._timeout) as resp:
+                        raw = await resp.read()
+                finally:
+                    self.metrics.leave()
+                self.breaker.success()
+                call.status = resp.status
+                call.sent += len(body)
+                call.received += len(raw)
+                if resp.status == 200:
+                    return self._decode(raw, req_type, name, call)
+                elif resp.status == 401:
+                    self.breaker.trip("Unauthorized")
+                    return "fail", "Unauthorized", None
+                elif self.retry.retryable(resp.status):
+                    return "retry", f"HTTP {resp.status}", resp.headers.get('Retry-After')
+                return "fail", f"HTTP {resp.status}", None
+        except CircuitOpen:
+            raise
+        except asyncio.TimeoutError:
+            logging.warning(f"Timeout {req_type} {name} attempt {call.attempts}")
+            self.breaker.failure("Timeout")
+            call.status = "timeout"
+            return "retry", "Timeout", None
+        except Exception as e:
+            logging.error(f"Error {req_type} {name}: {e}")
+            self.breaker.failure(type(e).__name__)
+            call.status = "error"
+            return "retry", f"Error: {e}", None
+    
+    def submit(self, fn, *args) -> Future:
+        return asyncio.run_coroutine_threadsafe(fn(*args), self.loop)
+    
+    def close(self):
+        asyncio.run_coroutine_threadsafe(self.session.close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
@@ -0,0 +1,292 @@
+import argparse
+import json
+import logging
+import math
+import os
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from runner import FILES, ConfigManager, Dispatcher, FileManager, PickupPlanCompiler, SkyAPIClient, create_client, json_codec
+
+# End-to-end throughput benchmark: replays the shipped plan files against mock_server.py (started as a
+# subprocess so it does not share our GIL) for every transport x worker-count combination.
+
+def _percentile(sorted_vals: List[float], pct: float) -> float:
+    if not sorted_vals:
+        return 0.0
+    return sorted_vals[max(0, math.ceil(pct / 100 * len(sorted_vals)) - 1)]
+
+def _rss_bytes() -> Optional[int]:
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+    except ImportError:
+        return None
+
+class Sampler(threading.Thread):
+    def __init__(self, interval: float = 0.02):
+        super().__init__(name="bench-sampler", daemon=True)
+        self.interval = interval
+        self.peak_threads = threading.active_count()
+        self.peak_rss = _rss_bytes()
+        self._halt = threading.Event()
+
+    def run(self):
+        while not self._halt.wait(self.interval):
+            self.peak_threads = max(self.peak_threads, threading.active_count())
+            rss = _rss_bytes()
+            if rss is not None:
+                self.peak_rss = max(self.peak_rss or 0, rss)
+
+    def stop(self):
+        self._halt.set()
+        self.join()
+
+def _timed(fn, latencies: List[float], is_async: bool):
+    if is_async:
+        async def wrapper(*args):
+            t0 = time.perf_counter()
+            try:
+                return await fn(*args)
+            finally:
+                latencies.append(time.perf_counter() - t0)
+    else:
+        def wrapper(*args):
+            t0 = time.perf_counter()
+            try:
+                return fn(*args)
+            finally:
+                latencies.append(time.perf_counter() - t0)
+    return wrapper
+
+def _scenarios(batch_size: int) -> Dict:
+    # Each scenario maps a client to (pre-steps, jobs); built lazily so plans are parsed once per run
+    def cr(client):
+        plan = PickupPlanCompiler.compile(FILES['pickup'], batch_size)
+        return [], [(client.collect_pickup_batch, (b["level_id"], b["pickup_ids"]), b["level_id"]) for b in plan]
+
+    def cr_raw(client):
+        jobs = []
+        with open(FILES['pickup'], 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    d = json.loads(line)
+                    jobs.append((client.collect_pickup_batch, (d["level_id"], d["pickup_ids"]), d["level_id"]))
+        return [], jobs
+
+    def quest(client):
+        quests = list(dict.fromkeys(FileManager.load_json(FILES['questname'], [])))
+        collectibles = list(dict.fromkeys(FileManager.load_json(FILES['collectible'], [])))
+        jobs = [(client.claim_quest_reward, (q,), q) for q in quests]
+        jobs += [(client.collect_collectible, (c,), c) for c in collectibles]
+        return [(client.get_account_world_quests, ())], jobs
+
+    return {"cr": cr, "cr-raw": cr_raw, "quest": quest}
+
+def run_one(config: Dict, scenario, name: str, transport: str, workers: int) -> Dict:
+    cfg = {**config, 'transport': transport, 'max_workers': workers, 'max_in_flight': workers}
+    client = create_client("bench-session", "bench-user", cfg)
+    disp = Dispatcher(client, workers)
+    latencies: List[float] = []
+    statuses = Counter()
+    sampler = Sampler()
+    sampler.start()
+    t0 = time.perf_counter()
+    try:
+        pre, jobs = scenario(client)
+        for fn, args in pre:
+            st, _ = disp.call(_timed(fn, latencies, client.owns_loop), *args)
+            statuses[st] += 1
+        jobs = [(_timed(fn, latencies, client.owns_loop), args, tag) for fn, args, tag in jobs]
+        skipped = disp.run(jobs, lambda tag, st, res: statuses.update([st]))
+    finally:
+        elapsed = time.perf_counter() - t0
+        sampler.stop()
+        disp.close()
+        client.close()
+    latencies.sort()
+    done = statuses['success'] + statuses['fail']
+    return {
+        "scenario": name, "transport": transport, "workers": workers,
+        "requests": done, "ok": statuses['success'], "failed": statuses['fail'], "skipped": skipped,
+        "seconds": round(elapsed, 3), "rps": round(done / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(_percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(_percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(_percentile(latencies, 99) * 1000, 1),
+        "peak_threads": sampler.peak_threads,
+        "peak_rss_mb": round(sampler.peak_rss / 2 ** 20, 1) if sampler.peak_rss else None,
+    }
+
+MICRO_REPLY = b'{"result": "collected 100"}'
+
+class EncodeOnlyClient(SkyAPIClient):
+    # Stops at the wire: endpoint methods build their headers and body, then decode a canned reply
+    def _make_request(self, endpoint: str, body: bytes, req_type: str, name: str, whole: bool = False):
+        self._get_headers()
+        res = self.codec.loads(MICRO_REPLY)
+        return "success", res if whole else res.get("result", "Success")
+
+class LegacyEncodeClient(EncodeOnlyClient):
+    # The request path before body templates, with the same call structure: a fresh payload dict handed
+    # to _make_request, which encodes it, builds a fresh headers dict and decodes the reply to text
+    # first the way requests' resp.json() does
+    def _make_request(self, endpoint: str, data: Dict, req_type: str, name: str, whole: bool = False):
+        json.dumps(data).encode()
+        self._get_headers()
+        res = json.loads(MICRO_REPLY.decode('utf-8'))
+        return "success", res if whole else res.get("result", "Success")
+    
+    def _get_headers(self) -> Dict[str, str]:
+        return {
+            'Host': 'live.radiance.thatgamecompany.com',
+            'Accept': '*/*',
+            'Content-Type': 'application/json',
+            'session': self.session_id,
+            'user': self.user_id,
+            'User-Agent': self.config['user_agent'],
+            'user-id': self.user_id
+        }
+    
+    def collect_pickup_batch(self, level_id: str, pickup_ids: List):
+        data = {"emitters": [], "global_pickup_ids": [], "level_id": level_id, "pickup_ids": pickup_ids,
+                "session": self.session_id, "user": self.user_id, "user_id": self.user_id}
+        return self._make_request("/account/collect_pickup_batch", data, "Level", level_id)
+
+def run_micro(config: Dict, variant: str, workers: int, rounds: int, repeat: int = 5) -> Dict:
+    # CPU per request with `workers` threads encoding the CR plan concurrently (best of `repeat`, as
+    # differences of a microsecond drown in scheduler noise otherwise), then (single thread, under
+    # tracemalloc) the peak memory one request allocates
+    cls, codec = {"legacy": (LegacyEncodeClient, "json"), "template": (EncodeOnlyClient, "json"),
+                  "template+orjson": (EncodeOnlyClient, "orjson")}[variant]
+    if json_codec(codec).name != codec:
+        raise ImportError(f"{codec} is not installed")
+    client = cls("bench-session", "bench-user", {**config, 'json_codec': codec})
+    plan = [(b["level_id"], b["pickup_ids"]) for b in PickupPlanCompiler.compile(FILES['pickup'], config['pickup_batch_size'])]
+    
+    def work():
+        for _ in range(rounds):
+            for level_id, pickup_ids in plan:
+                client.collect_pickup_batch(level_id, pickup_ids)
+    
+    elapsed = cpu = math.inf
+    for _ in range(max(1, repeat)):
+        threads = [threading.Thread(target=work) for _ in range(workers)]
+        t0, c0 = time.perf_counter(), time.process_time()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed, cpu = min(elapsed, time.perf_counter() - t0), min(cpu, time.process_time() - c0)
+    n = workers * rounds * len(plan)
+    tracemalloc.start()
+    peaks = []
+    for level_id, pickup_ids in plan:
+        base = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        client.collect_pickup_batch(level_id, pickup_ids)
+        peaks.append(tracemalloc.get_traced_memory()[1] - base)
+    tracemalloc.stop()
+    client.close()
+    return {"variant": variant, "workers": workers, "requests": n, "rps": round(n / elapsed),
+            "cpu_us": round(cpu / n * 1e6, 2), "alloc_peak_b": round(sum(peaks) / len(peaks))}
+
+def micro(args, config: Dict) -> List[Dict]:
+    results = []
+    print(f"{'variant':<16} {'workers':>7} {'reqs':>7} {'rps':>9} {'cpu_us/req':>10} {'alloc_B/req':>11}")
+    for variant in args.micro.split(","):
+        for workers in (int(w) for w in args.workers.split(",")):
+            try:
+                r = run_micro(config, variant, workers, args.micro_rounds, args.micro_repeat)
+            except ImportError as e:
+                print(f"{variant:<16} skipped: {e}")
+                break
+            results.append(r)
+            print(f"{variant:<16} {workers:>7} {r['requests']:>7} {r['rps']:>9} {r['cpu_us']:>10} {r['alloc_peak_b']:>11}", flush=True)
+    return results
+
+def start_mock(args) -> Tuple[subprocess.Popen, str]:
+    cmd = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "mock_server.py"),
+           "--port", "0", "--latency-ms", str(args.latency_ms), "--jitter-ms", str(args.jitter_ms),
+           "--error-rate", str(args.error_rate), "--slow-rate", str(args.slow_rate), "--slow-ms", str(args.slow_ms)]
+    if args.unauthorized_after is not None:
+        cmd += ["--unauthorized-after", str(args.unauthorized_after)]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True)
+    line = proc.stdout.readline()
+    if "listening on" not in line:
+        proc.kill()
+        raise RuntimeError(f"mock server failed to start: {line!r}")
+    return proc, line.rsplit(" ", 1)[-1].strip()
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput benchmark against mock_server.py")
+    parser.add_argument("--scenarios", default="cr,cr-raw,quest")
+    parser.add_argument("--transports", default="threads,asyncio")
+    parser.add_argument("--workers", default="5,10,20", help="max_workers (threads) / max_in_flight (asyncio) values")
+    parser.add_argument("--url", help="use an already running server instead of spawning mock_server.py")
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--jitter-ms", type=float, default=5)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--slow-rate", type=float, default=0.0)
+    parser.add_argument("--slow-ms", type=float, default=2000)
+    parser.add_argument("--unauthorized-after", type=int)
+    parser.add_argument("--adaptive", action="store_true", help="let AdaptiveLimit pick concurrency up to --workers")
+    parser.add_argument("--micro", nargs="?", const="legacy,template,template+orjson",
+                        help="skip the server and time request encoding/decoding only (legacy,template,template+orjson)")
+    parser.add_argument("--micro-rounds", type=int, default=20, help="passes over the CR plan per thread in --micro")
+    parser.add_argument("--micro-repeat", type=int, default=5, help="timed repeats per --micro row; the best is reported")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.epilog = ("Latency is measured around each endpoint call; on the asyncio transport that includes "
+                     "time spent waiting for a max_in_flight slot.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR, format='%(asctime)s - %(levelname)s - %(message)s')
+    config = ConfigManager.load_config()
+    config.update({'retry_base_delay': 0.05, 'retry_max_delay': 1, 'adaptive_concurrency': args.adaptive})
+    if args.micro:
+        results = micro(args, config)
+        if args.json:
+            with open(args.json, 'w', encoding='utf-8') as f:
+                json.dump(results, f, indent=4)
+        return
+    scenarios = _scenarios(config['pickup_batch_size'])
+    proc = None
+    if args.url:
+        config['base_url'] = args.url
+    else:
+        proc, config['base_url'] = start_mock(args)
+    results = []
+    try:
+        print(f"{'scenario':<8} {'transport':<9} {'workers':>7} {'reqs':>5} {'fail':>5} {'rps':>8} "
+              f"{'p50ms':>7} {'p95ms':>7} {'p99ms':>7} {'threads':>7} {'rssMB':>7}")
+        for name in args.scenarios.split(","):
+            for transport in args.transports.split(","):
+                for workers in (int(w) for w in args.workers.split(",")):
+                    try:
+                        r = run_one(config, scenarios[name], name, transport, workers)
+                    except ImportError as e:
+                        print(f"{name:<8} {transport:<9} skipped: {e}")
+                        break
+                    results.append(r)
+                    print(f"{name:<8} {transport:<9} {workers:>7} {r['requests']:>5} {r['failed']:>5} {r['rps']:>8} "
+                          f"{r['p50_ms']:>7} {r['p95_ms']:>7} {r['p99_ms']:>7} {r['peak_threads']:>7} "
+                          f"{r['peak_rss_mb'] if r['peak_rss_mb'] is not None else 'n/a':>7}", flush=True)
+    finally:
+        if proc:
+            proc.terminate()
+            proc.wait()
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=4)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+# Local stand-in for live.radiance.thatgamecompany.com, covering every endpoint SkyAPIClient calls.
+# Point a run at it with "base_url": "http://127.0.0.1:<port>" in config.json.
+ENDPOINTS = {
+    '/account/collect_pickup_batch',
+    '/account/get_account_world_quests',
+    '/account/claim_quest_reward',
+    '/account/collect_collectible',
+    '/service/relationship/api/v1/free_gifts/send',
+    '/account/send_message',
+}
+
+class MockSettings:
+    def __init__(self, latency_ms: float = 20, jitter_ms: float = 5, error_rate: float = 0.0,
+                 unauthorized_rate: float = 0.0, unauthorized_after: Optional[int] = None,
+                 slow_rate: float = 0.0, slow_ms: float = 2000, retry_after: Optional[float] = None,
+                 bad_body_rate: float = 0.0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.unauthorized_rate = unauthorized_rate
+        self.unauthorized_after = unauthorized_after
+        self.slow_rate = slow_rate
+        self.slow_ms = slow_ms
+        self.retry_after = retry_after
+        self.bad_body_rate = bad_body_rate
+
+class MockRadianceServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+    def __init__(self, addr, settings: MockSettings):
+        super().__init__(addr, MockHandler)
+        self.settings = settings
+        self.counts: Dict[str, int] = {}
+        self.total = 0
+        self._lock = threading.Lock()
+
+    def count(self, path: str) -> int:
+        with self._lock:
+            self.counts[path] = self.counts.get(path, 0) + 1
+            self.total += 1
+            return self.total
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; without this, delayed ACKs add ~40 ms per response
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if self.path not in ENDPOINTS:
+            return self._reply(404, {"error": "not found"})
+        s = self.server.settings
+        n = self.server.count(self.path)
+        delay = max(0.0, s.latency_ms + random.uniform(-s.jitter_ms, s.jitter_ms))
+        if s.slow_rate and random.random() < s.slow_rate:
+            delay = s.slow_ms
+        time.sleep(delay / 1000)
+        if not self.headers.get('session'):
+            return self._reply(401, {"error": "no session"})
+        if (s.unauthorized_after is not None and n > s.unauthorized_after) or \
+                (s.unauthorized_rate and random.random() < s.unauthorized_rate):
+            return self._reply(401, {"error": "session expired"})
+        if s.error_rate and random.random() < s.error_rate:
+            headers = {'Retry-After': str(s.retry_after)} if s.retry_after is not None else {}
+            return self._reply(503, {"error": "unavailable"}, headers)
+        try:
+            data = json.loads(body or b"{}")
+        except ValueError:
+            return self._reply(400, {"error": "bad json"})
+        if s.bad_body_rate and random.random() < s.bad_body_rate:
+            return self._reply(200, "<html>upstream error</html>")
+        self._reply(200, self._result(data))
+
+    def _result(self, data: Dict) -> Dict:
+        if self.path == '/account/get_account_world_quests':
+            return {"result": "ok", "quests": []}
+        if self.path == '/account/collect_pickup_batch':
+            return {"result": f"collected {len(data.get('pickup_ids') or [])}"}
+        return {"result": "ok"}
+
+    def _reply(self, code: int, payload, headers: Optional[Dict] = None):
+        # A str payload is sent as-is, for malformed bodies
+        out = payload.encode() if isinstance(payload, str) else json.dumps(payload).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(out)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(out)
+
+    def log_message(self, fmt, *args):
+        pass
+
+def serve(host: str = "127.0.0.1", port: int = 0, settings: Optional[MockSettings] = None) -> MockRadianceServer:
+    # Starts the server on a daemon thread; port 0 picks a free port (see server.url)
+    server = MockRadianceServer((host, port), settings or MockSettings())
+    threading.Thread(target=server.serve_forever, name="mock-radiance", daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Local mock of the Radiance endpoints used by SkyAPIClient")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8787)
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--jitter-ms", type=float, default=5)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 503")
+    parser.add_argument("--retry-after", type=float, help="Retry-After seconds sent with 503s")
+    parser.add_argument("--unauthorized-rate", type=float, default=0.0, help="fraction of requests answered with 401")
+    parser.add_argument("--unauthorized-after", type=int, help="answer 401 to every request after the first N")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="fraction of requests delayed by --slow-ms")
+    parser.add_argument("--slow-ms", type=float, default=2000)
+    parser.add_argument("--bad-body-rate", type=float, default=0.0, help="fraction of 200s sent with a non-JSON body")
+    args = parser.parse_args()
+    settings = MockSettings(args.latency_ms, args.jitter_ms, args.error_rate, args.unauthorized_rate,
+                            args.unauthorized_after, args.slow_rate, args.slow_ms, args.retry_after,
+                            args.bad_body_rate)
+    server = MockRadianceServer((args.host, args.port), settings)
+    print(f"Mock Radiance listening on {server.url}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
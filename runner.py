@@ -0,0 +1,2138 @@
+import threading
+import json
+import functools
+import contextlib
+import io
+import os
+import sys
+import time
+import hashlib
+import gzip
+import heapq
+import itertools
+import random
+import tempfile
+import argparse
+import csv
+import math
+import sqlite3
+from bisect import bisect_left
+from collections import deque
+from email.utils import parsedate_to_datetime
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Lock
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+import logging
+
+# Constants
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+FILES = {
+    'pickup': os.path.join(BASE_DIR, "pickup_data.json"),
+    'pickup_plan': os.path.join(BASE_DIR, "pickup_plan.cache.json"),
+    'journal': os.path.join(BASE_DIR, "run_journal.jsonl"),
+    'users': os.path.join(BASE_DIR, "users.json"),
+    'questname': os.path.join(BASE_DIR, "questname.json"),
+    'collectible': os.path.join(BASE_DIR, "claimquest.json"),
+    'targets': os.path.join(BASE_DIR, "targets.json"),
+    'store': os.path.join(BASE_DIR, "skycr.db"),
+    'config': os.path.join(BASE_DIR, "config.json")
+}
+
+DEFAULT_USER_AGENT = 'Sky-Live-com.tgc.sky.win/0.28.1.310103 (To Be Filled By O.E.M.; win 10.0.22621; en)'
+BASE_URL = 'https://live.radiance.thatgamecompany.com'
+
+class ConfigManager:
+    @staticmethod
+    def load_config() -> Dict:
+        default = {
+            'user_agent': DEFAULT_USER_AGENT,
+            'base_url': BASE_URL,
+            'max_workers': 10,
+            'request_timeout': 10,
+            'max_retries': 3,
+            'pickup_batch_size': 100,
+            'pickup_compile': True,
+            'max_pending': 0,
+            'transport': 'threads',
+            'max_in_flight': 50,
+            'retry_base_delay': 1.0,
+            'retry_max_delay': 30,
+            'retry_budgets': {},
+            'breaker_threshold': 5,
+            'journal_ttl_hours': 12,
+            'metrics_dir': '',
+            'metrics_panel': False,
+            'store': 'sqlite',
+            'client_idle_timeout': 300,
+            'quest_snapshot_ttl': 60,
+            'adaptive_concurrency': True,
+            'profile_dir': '',
+            'profile_top': 25,
+            'max_jobs': 4,
+            'json_codec': 'auto'
+        }
+        if not os.path.exists(FILES['config']):
+            ConfigManager.save_config(default)
+            return default
+        try:
+            with open(FILES['config'], 'r', encoding='utf-8') as f:
+                return {**default, **json.load(f)}
+        except:
+            return default
+    
+    @staticmethod
+    def save_config(config: Dict) -> bool:
+        try:
+            with open(FILES['config'], 'w', encoding='utf-8') as f:
+                json.dump(config, f, indent=4)
+            return True
+        except:
+            return False
+
+class RetryLater(Exception):
+    def __init__(self, delay: float):
+        super().__init__(delay)
+        self.delay = delay
+
+class RetryPolicy:
+    RETRYABLE = {408, 425, 429, 500, 502, 503, 504}
+    
+    def __init__(self, config: Dict):
+        self.base = float(config['retry_base_delay'])
+        self.cap = float(config['retry_max_delay'])
+        self.default_budget = config['max_retries']
+        self.budgets = config.get('retry_budgets') or {}
+    
+    def budget(self, endpoint: str) -> int:
+        # retry_budgets may be keyed by full path or by its last segment, e.g. "collect_pickup_batch"
+        return self.budgets.get(endpoint, self.budgets.get(endpoint.rsplit('/', 1)[-1], self.default_budget))
+    
+    def retryable(self, status: Optional[int]) -> bool:
+        return status is None or status in self.RETRYABLE
+    
+    def delay(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        server = self._parse_retry_after(retry_after)
+        if server is not None:
+            return min(self.cap, server)
+        return random.uniform(0, min(self.cap, self.base * 2 ** attempt))
+    
+    @staticmethod
+    def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+class RetryScheduler:
+    # Delay queue shared by every Dispatcher: a failed call is parked here until its backoff elapses and
+    # is then handed back to its pool, so no worker thread sleeps through a retry.
+    def __init__(self):
+        self._heap = []
+        self._seq = itertools.count()
+        self._cv = threading.Condition()
+        self._thread = None
+    
+    def schedule(self, delay: float, fn):
+        with self._cv:
+            heapq.heappush(self._heap, (time.monotonic() + delay, next(self._seq), fn))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="sky-retry", daemon=True)
+                self._thread.start()
+            self._cv.notify()
+    
+    def _loop(self):
+        while True:
+            with self._cv:
+                while not self._heap or self._heap[0][0] > time.monotonic():
+                    self._cv.wait(self._heap[0][0] - time.monotonic() if self._heap else None)
+                _, _, fn = heapq.heappop(self._heap)
+            try:
+                fn()
+            except Exception as e:
+                logging.error(f"Retry dispatch failed: {e}")
+
+class CircuitOpen(Exception):
+    pass
+
+class CircuitBreaker:
+    # Per-run state shared by every call of one client: the first 401, or `threshold` consecutive
+    # transport failures, opens it and all later calls fail fast without touching the network.
+    def __init__(self, threshold: int):
+        self.threshold = max(1, int(threshold))
+        self.reason = None
+        self._failures = 0
+        self._listeners = []
+        self._lock = Lock()
+    
+    @property
+    def open(self) -> bool:
+        return self.reason is not None
+    
+    def on_trip(self, fn):
+        self._listeners.append(fn)
+    
+    def trip(self, reason: str):
+        with self._lock:
+            if self.reason is not None:
+                return
+            self.reason = reason
+        logging.warning(f"Circuit open: {reason}")
+        for fn in self._listeners:
+            fn()
+    
+    def success(self):
+        self._failures = 0
+    
+    def failure(self, reason: str):
+        with self._lock:
+            self._failures += 1
+            tripped = self._failures >= self.threshold
+        if tripped:
+            self.trip(f"{self._failures} consecutive transport failures ({reason})")
+    
+    def check(self):
+        if self.reason is not None:
+            raise CircuitOpen(self.reason)
+
+class CallStats:
+    # Per-call bookkeeping that survives deferred retries: queued when submitted, started at the first
+    # send, so queue wait = started - queued and wall time = end - started (backoff included).
+    __slots__ = ('queued', 'started', 'attempts', 'status', 'sent', 'received')
+    
+    def __init__(self, queued: Optional[float] = None):
+        self.queued = queued if queued is not None else time.perf_counter()
+        self.started = None
+        self.attempts = 0
+        self.status = None
+        self.sent = self.received = 0
+
+class Histogram:
+    # Fixed log-spaced buckets (0.5 ms .. ~10 min, x1.25), so add() is one bisect and percentiles
+    # are accurate to within a bucket
+    BOUNDS = [0.0005 * 1.25 ** i for i in range(64)]
+    __slots__ = ('counts', 'count', 'total', 'max')
+    
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = self.max = 0.0
+    
+    def add(self, value: float):
+        self.counts[bisect_left(self.BOUNDS, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+    
+    def percentile(self, pct: float) -> float:
+        if not self.count:
+            return 0.0
+        target, seen = max(1, math.ceil(pct / 100 * self.count)), 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= target:
+                return min(self.BOUNDS[i], self.max) if i < len(self.BOUNDS) else self.max
+        return self.max
+
+class Metrics:
+    CSV_FIELDS = ['endpoint', 'calls', 'attempts', 'retries', 'status', 'bytes_sent', 'bytes_received',
+                  'wall_mean_ms', 'wall_p50_ms', 'wall_p95_ms', 'wall_p99_ms', 'wall_max_ms',
+                  'queue_p50_ms', 'queue_p95_ms', 'queue_max_ms']
+    
+    def __init__(self):
+        self._lock = Lock()
+        self._endpoints: Dict[str, Dict] = {}
+        self.in_flight = self.peak_in_flight = 0
+    
+    def enter(self):
+        with self._lock:
+            self.in_flight += 1
+            if self.in_flight > self.peak_in_flight:
+                self.peak_in_flight = self.in_flight
+    
+    def leave(self):
+        with self._lock:
+            self.in_flight -= 1
+    
+    def record(self, endpoint: str, call: CallStats):
+        end = time.perf_counter()
+        started = call.started if call.started is not None else end
+        with self._lock:
+            e = self._endpoints.get(endpoint)
+            if e is None:
+                e = self._endpoints[endpoint] = {'calls': 0, 'attempts': 0, 'sent': 0, 'received': 0,
+                                                 'status': {}, 'wall': Histogram(), 'queue': Histogram()}
+            e['calls'] += 1
+            e['attempts'] += call.attempts
+            e['sent'] += call.sent
+            e['received'] += call.received
+            e['status'][call.status] = e['status'].get(call.status, 0) + 1
+            e['wall'].add(end - started)
+            e['queue'].add(max(0.0, started - call.queued))
+    
+    def summary(self) -> List[Dict]:
+        ms = lambda v: round(v * 1000, 1)
+        with self._lock:
+            rows = []
+            for endpoint, e in sorted(self._endpoints.items()):
+                wall, queue = e['wall'], e['queue']
+                rows.append({
+                    'endpoint': endpoint, 'calls': e['calls'], 'attempts': e['attempts'],
+                    'retries': e['attempts'] - e['calls'], 'status': dict(e['status']),
+                    'bytes_sent': e['sent'], 'bytes_received': e['received'],
+                    'wall_mean_ms': ms(wall.total / wall.count) if wall.count else 0.0,
+                    'wall_p50_ms': ms(wall.percentile(50)), 'wall_p95_ms': ms(wall.percentile(95)),
+                    'wall_p99_ms': ms(wall.percentile(99)), 'wall_max_ms': ms(wall.max),
+                    'queue_p50_ms': ms(queue.percentile(50)), 'queue_p95_ms': ms(queue.percentile(95)),
+                    'queue_max_ms': ms(queue.max),
+                })
+            return rows
+    
+    def export(self, directory: str, name: str) -> Tuple[str, str]:
+        os.makedirs(directory, exist_ok=True)
+        rows = self.summary()
+        json_path = os.path.join(directory, f"{name}.json")
+        csv_path = os.path.join(directory, f"{name}.csv")
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump({'peak_in_flight': self.peak_in_flight, 'endpoints': rows}, f, indent=4)
+        with open(csv_path, 'w', encoding='utf-8', newline='') as f:
+            w = csv.DictWriter(f, fieldnames=self.CSV_FIELDS)
+            w.writeheader()
+            for r in rows:
+                w.writerow({**r, 'status': ";".join(f"{k}={v}" for k, v in r['status'].items())})
+        return json_path, csv_path
+
+class RunProfiler:
+    # cProfile + tracemalloc around one run, written to <dir>/<name>.prof (pstats, all threads merged)
+    # and <name>.txt (top-N by cumulative and own time, top-N allocation sites). Before Python 3.12
+    # cProfile only sees the thread that enabled it, so worker threads call thread_init() to get their
+    # own Profile; from 3.12 one profiler already covers every thread and thread_init() does nothing.
+    # From 3.12 cProfile is also process-wide (sys.monitoring) and only one can be active, so a run
+    # that overlaps a profiled one skips cProfile and reports allocations only. tracemalloc is too, so overlapping profilers share it through a reference count and the
+    # last one out stops it (unless something else had it running first). The profiling modules are
+    # imported on first use so runs without profile_dir never load them.
+    _trace_lock = Lock()
+    _trace_refs = 0
+    _trace_owned = False
+    
+    def __init__(self, directory: str, name: str, top: int = 25):
+        self.directory = directory
+        self.name = name
+        self.top = top
+        self.paths: Optional[Tuple[Optional[str], str]] = None
+        self.error: Optional[str] = None
+        self._profiles: List = []
+        self._lock = Lock()
+    
+    def thread_init(self):
+        import cProfile
+        prof = cProfile.Profile()
+        try:
+            prof.enable()
+        except ValueError:
+            return
+        with self._lock:
+            self._profiles.append(prof)
+    
+    def __enter__(self):
+        import cProfile
+        import tracemalloc
+        with RunProfiler._trace_lock:
+            if RunProfiler._trace_refs == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                RunProfiler._trace_owned = True
+            RunProfiler._trace_refs += 1
+        try:
+            self._main = cProfile.Profile()
+            self._main.enable()
+        except ValueError:
+            self._main = None
+        except BaseException:
+            with RunProfiler._trace_lock:
+                self._release_trace()
+            raise
+        return self
+    
+    @staticmethod
+    def _release_trace():
+        import tracemalloc
+        RunProfiler._trace_refs -= 1
+        if RunProfiler._trace_refs == 0 and RunProfiler._trace_owned:
+            tracemalloc.stop()
+            RunProfiler._trace_owned = False
+    
+    def __exit__(self, *exc):
+        import tracemalloc
+        if self._main:
+            self._main.disable()
+        try:
+            with RunProfiler._trace_lock:
+                try:
+                    snapshot = tracemalloc.take_snapshot()
+                    _, peak = tracemalloc.get_traced_memory()
+                finally:
+                    self._release_trace()
+            self.paths = self._write(snapshot, peak)
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+        return False
+    
+    def _write(self, snapshot, peak: int) -> Tuple[Optional[str], str]:
+        # The .prof path is None when another profiler held cProfile for the whole run
+        import pstats
+        os.makedirs(self.directory, exist_ok=True)
+        prof_path = os.path.join(self.directory, f"{self.name}.prof")
+        txt_path = os.path.join(self.directory, f"{self.name}.txt")
+        out = io.StringIO()
+        with self._lock:
+            profiles = [self._main] * bool(self._main) + self._profiles
+        out.write(f"{self.name}: {len(profiles)} thread profile(s), peak traced memory {peak / 2 ** 20:.1f} MiB\n")
+        if profiles:
+            stats = pstats.Stats(*profiles, stream=out)
+            stats.dump_stats(prof_path)
+            stats.strip_dirs().sort_stats('cumulative').print_stats(self.top)
+            stats.sort_stats('tottime').print_stats(self.top)
+        else:
+            prof_path = None
+            out.write("No call profile: another run's profiler was active (one per process from Python 3.12)\n")
+        out.write(f"Top {self.top} allocation sites:\n")
+        for stat in snapshot.statistics('lineno')[:self.top]:
+            out.write(f"  {stat}\n")
+        with open(txt_path, 'w', encoding='utf-8') as f:
+            f.write(out.getvalue())
+        return prof_path, txt_path
+
+RETRY_SCHEDULER = RetryScheduler()
+_dispatch_ctx = threading.local()
+
+class JsonCodec:
+    # Request bodies and response payloads go through dumps(value) -> bytes and loads(bytes). splice
+    # says whether encoding a body's variable fields one by one beats one dumps of the whole body: true
+    # for orjson; the stdlib's per-call overhead costs more than the fixed fields it would skip.
+    def __init__(self, name: str, dumps: Callable[[object], bytes], loads: Callable[[bytes], object],
+                 splice: bool = False):
+        self.name = name
+        self.dumps = dumps
+        self.loads = loads
+        self.splice = splice
+
+def _stdlib_loads(raw: bytes):
+    # json.loads sniffs the encoding of bytes in Python; JSON on the wire is UTF-8
+    return json.loads(raw.decode('utf-8'))
+
+@functools.lru_cache(maxsize=None)
+def json_codec(name: str = 'auto') -> JsonCodec:
+    # "auto" and "orjson" use orjson when it is installed, anything else the stdlib json module
+    if name in ('auto', 'orjson'):
+        try:
+            import orjson
+            return JsonCodec('orjson', orjson.dumps, orjson.loads, splice=True)
+        except ImportError:
+            if name == 'orjson':
+                logging.warning("orjson is not installed; using the stdlib json codec")
+    return JsonCodec('json', lambda value: json.dumps(value).encode(), _stdlib_loads)
+
+class BodyTemplate:
+    # A JSON object body whose fixed fields are encoded once. Fields named in `variables` are left as
+    # holes; render() takes their already encoded values in field order and joins them with the cached
+    # chunks. With stdlib-encoded values the result is byte for byte json.dumps(fields). encode() uses
+    # that for codecs that splice and otherwise encodes the whole body in one dumps.
+    def __init__(self, fields: Dict, variables: Tuple[str, ...] = ()):
+        self._fields = fields
+        self._variables = variables
+        chunks, cur = [], "{"
+        for i, (key, value) in enumerate(fields.items()):
+            cur += (", " if i else "") + json.dumps(key) + ": "
+            if key in variables:
+                chunks.append(cur.encode())
+                cur = ""
+            else:
+                cur += json.dumps(value)
+        chunks.append((cur + "}").encode())
+        self._head = chunks[0]
+        self._rest = chunks[1:]
+    
+    def render(self, *values: bytes) -> bytes:
+        parts = [self._head]
+        for value, chunk in zip(values, self._rest):
+            parts += (value, chunk)
+        return b"".join(parts)
+    
+    def encode(self, codec: JsonCodec, *values) -> bytes:
+        if codec.splice or not values:
+            return self.render(*map(codec.dumps, values))
+        data = self._fields.copy()
+        data.update(zip(self._variables, values))
+        return codec.dumps(data)
+
+class SkyAPIClient:
+    owns_loop = False
+    
+    def __init__(self, session_id: str, user_id: str, config: Dict):
+        import requests
+        import urllib3
+        urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+        self._requests = requests
+        self.session_id = session_id
+        self.user_id = user_id
+        self.start_run(config)
+        self.session = requests.Session()
+        self.session.verify = False
+        # One connection per worker thread; urllib3's default of 10 would make the extra workers open
+        # and discard connections on every call
+        self.pool_size = max(1, int(config['max_workers']))
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=self.pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+    
+    def start_run(self, config: Dict):
+        # Per-run state; the HTTP session and its connections survive across runs (see TransportManager)
+        self.config = config
+        self.retry = RetryPolicy(config)
+        self.breaker = CircuitBreaker(config['breaker_threshold'])
+        self.metrics = Metrics()
+        # feedback(status, seconds) is called after every attempt; Dispatcher wires it to AdaptiveLimit
+        self.feedback: Optional[Callable] = None
+        # Headers and bodies only vary in a few fields per call, so everything else is built once here
+        self.codec = json_codec(config.get('json_codec', 'auto'))
+        self._headers = {
+            'Host': 'live.radiance.thatgamecompany.com',
+            'Accept': '*/*',
+            'Content-Type': 'application/json',
+            'session': self.session_id,
+            'user': self.user_id,
+            'User-Agent': config['user_agent'],
+            'user-id': self.user_id
+        }
+        ids = {"session": self.session_id, "user": self.user_id, "user_id": self.user_id}
+        self._bodies = {
+            'pickup': BodyTemplate({"emitters": [], "global_pickup_ids": [], "level_id": None, "pickup_ids": None, **ids},
+                                   ("level_id", "pickup_ids")),
+            'world_quests': BodyTemplate(ids),
+            'quest': BodyTemplate({"bonus_percent": 0, "name": None, **ids}, ("name",)),
+            'collectible': BodyTemplate({"carrying": False, "name": None, **ids}, ("name",)),
+            'light': BodyTemplate({"gift_type": "gift_heart_wax", "session": self.session_id, "target": None,
+                                   "user": self.user_id, "user_id": self.user_id}, ("target",)),
+            'heart': BodyTemplate({"gift_type": "gift", "session": self.session_id, "target": None,
+                                   "user": self.user_id, "user_id": self.user_id}, ("target",)),
+        }
+    
+    def _get_headers(self) -> Dict[str, str]:
+        return self._headers
+    
+    def _make_request(self, endpoint: str, body: bytes, req_type: str, name: str, whole: bool = False) -> Tuple[str, Optional[str]]:
+        # whole=True returns the decoded response body on success instead of just its "result" field
+        url = f"{self.config['base_url']}{endpoint}"
+        budget = self.retry.budget(endpoint)
+        # Inside a Dispatcher worker the CallStats (and with it the attempt count) comes from the
+        # dispatcher and backoff is handed to RETRY_SCHEDULER; direct calls sleep in place.
+        call = getattr(_dispatch_ctx, 'call', None)
+        deferred = call is not None
+        call = call or CallStats()
+        if call.started is None:
+            call.started = time.perf_counter()
+        while True:
+            self.breaker.check()
+            call.attempts += 1
+            t0 = time.perf_counter()
+            self.metrics.enter()
+            try:
+                st, res, retry_after = self._send(url, body, req_type, name, call)
+            finally:
+                self.metrics.leave()
+            if self.feedback:
+                self.feedback(call.status, time.perf_counter() - t0)
+            if st != "retry" or call.attempts >= budget:
+                self.metrics.record(endpoint, call)
+                if st == "success" and not whole:
+                    res = res.get("result", "Success")
+                return ("fail" if st == "retry" else st), res
+            delay = self.retry.delay(call.attempts, retry_after)
+            if deferred:
+                raise RetryLater(delay)
+            time.sleep(delay)
+    
+    def _send(self, url: str, body: bytes, req_type: str, name: str, call: CallStats) -> Tuple[str, Optional[str], Optional[str]]:
+        try:
+            resp = self.session.post(url, headers=self._get_headers(), data=body, timeout=self.config['request_timeout'])
+        except self._requests.exceptions.Timeout:
+            logging.warning(f"Timeout {req_type} {name} attempt {call.attempts}")
+            self.breaker.failure("Timeout")
+            call.status = "timeout"
+            return "retry", "Timeout", None
+        except Exception as e:
+            logging.error(f"Error {req_type} {name}: {e}")
+            self.breaker.failure(type(e).__name__)
+            call.status = "error"
+            return "retry", f"Error: {e}", None
+        self.breaker.success()
+        call.status = resp.status_code
+        call.sent += len(body)
+        call.received += len(resp.content)
+        if resp.status_code == 200:
+            return self._decode(resp.content, req_type, name, call)
+        elif resp.status_code == 401:
+            self.breaker.trip("Unauthorized")
+            return "fail", "Unauthorized", None
+        elif self.retry.retryable(resp.status_code):
+            return "retry", f"HTTP {resp.status_code}", resp.headers.get('Retry-After')
+        return "fail", f"HTTP {resp.status_code}", None
+    
+    def _decode(self, raw: bytes, req_type: str, name: str, call: CallStats) -> Tuple[str, object, None]:
+        # A 200 whose body is not a JSON object is retried; the connection itself worked, so it does not
+        # count towards the breaker
+        try:
+            res = self.codec.loads(raw)
+        except ValueError:
+            res = None
+        if isinstance(res, dict):
+            return "success", res, None
+        logging.warning(f"Bad response body {req_type} {name} attempt {call.attempts}: {raw[:60]!r}")
+        call.status = "bad_body"
+        return "retry", "Bad response body", None
+    
+    def collect_pickup_batch(self, level_id: str, pickup_ids: List):
+        body = self._bodies['pickup'].encode(self.codec, level_id, pickup_ids)
+        return self._make_request("/account/collect_pickup_batch", body, "Level", level_id)
+    
+    def get_account_world_quests(self):
+        body = self._bodies['world_quests'].encode(self.codec)
+        return self._make_request("/account/get_account_world_quests", body, "Pre", "Pre", whole=True)
+    
+    def claim_quest_reward(self, name: str):
+        body = self._bodies['quest'].encode(self.codec, name)
+        return self._make_request("/account/claim_quest_reward", body, "Quest", name)
+    
+    def collect_collectible(self, name: str):
+        body = self._bodies['collectible'].encode(self.codec, name)
+        return self._make_request("/account/collect_collectible", body, "Collectible", name)
+    
+    def send_light(self, target_id: str, target_name: str):
+        body = self._bodies['light'].encode(self.codec, target_id)
+        return self._make_request("/service/relationship/api/v1/free_gifts/send", body, "Light", target_name)
+    
+    def send_heart(self, target_id: str, target_name: str):
+        body = self._bodies['heart'].encode(self.codec, target_id)
+        return self._make_request("/account/send_message", body, "Heart", target_name)
+    
+    def close(self):
+        self.session.close()
+
+def create_client(session_id: str, user_id: str, config: Dict) -> SkyAPIClient:
+    if config.get('transport') == 'asyncio':
+        from async_client import AsyncSkyAPIClient
+        return AsyncSkyAPIClient(session_id, user_id, config)
+    return SkyAPIClient(session_id, user_id, config)
+
+class TransportManager:
+    # Keeps clients warm between runs, keyed by (transport, session, user), so repeat runs reuse open
+    # connections instead of paying the TLS handshakes again. A released client is closed after
+    # client_idle_timeout seconds unused, when its breaker tripped, or when the configured pool size
+    # changed. A key already in use gets a one-off client that is closed on release.
+    def __init__(self):
+        self._clients: Dict[Tuple[str, str, str], Dict] = {}
+        self._lock = Lock()
+    
+    @staticmethod
+    def _key(session_id: str, user_id: str, config: Dict) -> Tuple[str, str, str]:
+        return config.get('transport', 'threads'), session_id, user_id
+    
+    @staticmethod
+    def _pool_size(config: Dict) -> int:
+        return max(1, int(config['max_in_flight' if config.get('transport') == 'asyncio' else 'max_workers']))
+    
+    def acquire(self, session_id: str, user_id: str, config: Dict) -> SkyAPIClient:
+        key = self._key(session_id, user_id, config)
+        stale = None
+        with self._lock:
+            entry = self._clients.get(key)
+            if entry and not entry['busy']:
+                if entry['client'].pool_size == self._pool_size(config):
+                    entry['busy'] = True
+                    entry['client'].start_run(config)
+                    return entry['client']
+                stale = self._clients.pop(key)['client']
+        if stale:
+            stale.close()
+        client = create_client(session_id, user_id, config)
+        with self._lock:
+            if key not in self._clients:
+                self._clients[key] = {'client': client, 'busy': True, 'last_used': time.monotonic()}
+        return client
+    
+    def release(self, client: SkyAPIClient):
+        key = self._key(client.session_id, client.user_id, client.config)
+        timeout = client.config['client_idle_timeout']
+        with self._lock:
+            entry = self._clients.get(key)
+            cached = entry is not None and entry['client'] is client
+            if cached and not client.breaker.open and timeout > 0:
+                entry['busy'] = False
+                entry['last_used'] = time.monotonic()
+                RETRY_SCHEDULER.schedule(timeout, lambda: self._evict(key, timeout))
+                return
+            if cached:
+                del self._clients[key]
+        client.close()
+    
+    def _evict(self, key: Tuple[str, str, str], timeout: float):
+        with self._lock:
+            entry = self._clients.get(key)
+            if not entry or entry['busy'] or time.monotonic() - entry['last_used'] < timeout:
+                return
+            del self._clients[key]
+        entry['client'].close()
+    
+    def close_all(self):
+        with self._lock:
+            idle = [k for k, e in self._clients.items() if not e['busy']]
+            clients = [self._clients.pop(k)['client'] for k in idle]
+        for c in clients:
+            c.close()
+
+TRANSPORTS = TransportManager()
+
+class QuestIndex:
+    # Parsed get_account_world_quests payload. Its schema is undocumented, so parsing is defensive: any
+    # dict with a string name-like field (or a {name: {...}} mapping under a quest key) is a quest
+    # record, and it counts as claimed when a claimed-like flag is set or its status/state says so.
+    NAME_KEYS = ('name', 'quest_name', 'quest_id', 'quest')
+    CLAIMED_KEYS = ('claimed', 'reward_claimed', 'rewarded', 'is_claimed')
+    CLAIMED_STATES = {'claimed', 'rewarded', 'reward_claimed', 'collected'}
+    MAX_DEPTH = 6
+    
+    def __init__(self, payload):
+        self.claimed: Dict[str, bool] = {}
+        self.taken = time.monotonic()
+        self._walk(payload, 0, False)
+    
+    def _walk(self, node, depth: int, quest_map: bool):
+        if depth > self.MAX_DEPTH:
+            return
+        if isinstance(node, list):
+            for item in node:
+                self._walk(item, depth + 1, False)
+        elif isinstance(node, dict):
+            name = next((node[k] for k in self.NAME_KEYS if isinstance(node.get(k), str)), None)
+            if name:
+                self._add(name, node)
+            for k, v in node.items():
+                if quest_map and isinstance(v, dict) and not any(n in v for n in self.NAME_KEYS):
+                    self._add(k, v)
+                if isinstance(v, (list, dict)):
+                    self._walk(v, depth + 1, isinstance(k, str) and 'quest' in k.lower())
+    
+    def _add(self, name: str, record: Dict):
+        state = str(record.get('status') or record.get('state') or '').lower()
+        done = state in self.CLAIMED_STATES or any(record.get(k) is True for k in self.CLAIMED_KEYS)
+        self.claimed[name] = self.claimed.get(name, False) or done
+    
+    def covers(self, names: Iterable[str]) -> bool:
+        # Only trusted when it lists at least one planned quest; otherwise the schema guess is wrong
+        return any(n in self.claimed for n in names)
+    
+    def actionable(self, name: str) -> bool:
+        return self.claimed.get(name) is False
+    
+    def mark_claimed(self, name: str):
+        self.claimed[name] = True
+
+class SnapshotCache:
+    # Last QuestIndex per user, reused for back-to-back runs within quest_snapshot_ttl seconds
+    def __init__(self):
+        self._snaps: Dict[str, QuestIndex] = {}
+        self._lock = Lock()
+    
+    def get(self, user_id: str, ttl: float) -> Optional[QuestIndex]:
+        with self._lock:
+            snap = self._snaps.get(user_id)
+        return snap if snap and time.monotonic() - snap.taken < ttl else None
+    
+    def put(self, user_id: str, snap: QuestIndex):
+        with self._lock:
+            self._snaps[user_id] = snap
+    
+    def drop(self, user_id: Optional[str] = None):
+        with self._lock:
+            if user_id is None:
+                self._snaps.clear()
+            else:
+                self._snaps.pop(user_id, None)
+
+QUEST_SNAPSHOTS = SnapshotCache()
+
+class AdaptiveLimit:
+    # AIMD gate on calls in flight, used by Dispatcher.run in place of a fixed window. Each healthy
+    # response grows the limit by 1/limit (about +1 per round trip of the whole window), but only while
+    # latency stays within `tolerance` x the baseline. A timeout, transport error, 429 or 5xx multiplies
+    # it by `backoff`, at most once per smoothed round trip so one burst of failures is one signal.
+    def __init__(self, ceiling: int, floor: int = 1, backoff: float = 0.5, tolerance: float = 2.0):
+        self.ceiling = max(1, ceiling)
+        self.floor = min(floor, self.ceiling)
+        self.limit = float(max(self.floor, self.ceiling // 2))
+        self.backoff = backoff
+        self.tolerance = tolerance
+        self.in_flight = 0
+        self._cv = threading.Condition()
+        self._base: Optional[float] = None
+        self._rtt = 0.0
+        self._cut_at = 0.0
+    
+    @property
+    def current(self) -> int:
+        return int(self.limit)
+    
+    def acquire(self):
+        with self._cv:
+            while self.in_flight >= int(self.limit):
+                self._cv.wait()
+            self.in_flight += 1
+    
+    def release(self):
+        with self._cv:
+            self.in_flight -= 1
+            self._cv.notify()
+    
+    def observe(self, status, seconds: float):
+        overload = status in ("timeout", "error", 429) or (isinstance(status, int) and status >= 500)
+        with self._cv:
+            if overload:
+                now = time.monotonic()
+                if now - self._cut_at >= self._rtt:
+                    self.limit = max(float(self.floor), self.limit * self.backoff)
+                    self._cut_at = now
+                return
+            if not isinstance(status, int) or status >= 300:
+                return
+            # Baseline follows new minimums at once and drifts up slowly, so a lasting shift in server
+            # latency is eventually accepted as the new normal
+            self._base = seconds if self._base is None or seconds < self._base else self._base + 0.01 * (seconds - self._base)
+            self._rtt += 0.2 * (seconds - self._rtt)
+            if seconds <= self.tolerance * self._base and self.limit < self.ceiling:
+                grew = int(self.limit)
+                self.limit = min(float(self.ceiling), self.limit + 1 / self.limit)
+                if int(self.limit) > grew:
+                    self._cv.notify()
+
+class Dispatcher:
+    # Runs client endpoint calls either on a thread pool (SkyAPIClient) or on the client's own event
+    # loop (AsyncSkyAPIClient); callers only ever see concurrent Futures.
+    def __init__(self, client: SkyAPIClient, max_workers: int, pool: Optional["FairLane"] = None,
+                 initializer: Optional[Callable[[], None]] = None):
+        self.client = client
+        self.pool = None if client.owns_loop else pool or ThreadPoolExecutor(max_workers=max_workers, initializer=initializer)
+        if initializer and client.owns_loop:
+            client.loop.call_soon_threadsafe(initializer)
+        # Bounded hand-off in front of the workers: run() never has more than max_pending calls
+        # submitted but unfinished, so memory stays flat however long the job stream is
+        width = client.config['max_in_flight'] if client.owns_loop else max_workers
+        self.max_pending = client.config.get('max_pending') or 2 * width
+        self.limiter = AdaptiveLimit(width) if client.config.get('adaptive_concurrency') else None
+        if self.limiter:
+            client.feedback = self.limiter.observe
+        self._pending = set()
+        self._lock = Lock()
+        client.breaker.on_trip(self.cancel_pending)
+    
+    def submit(self, fn, *args) -> Future:
+        if self.pool is None:
+            return self.client.submit(fn, *args)
+        fut = Future()
+        self.pool.submit(self._attempt, fut, fn, args, CallStats())
+        return fut
+    
+    def _attempt(self, fut: Future, fn, args, call: CallStats):
+        if call.attempts == 0 and not fut.set_running_or_notify_cancel():
+            return
+        _dispatch_ctx.call = call
+        try:
+            fut.set_result(fn(*args))
+        except RetryLater as r:
+            RETRY_SCHEDULER.schedule(r.delay, lambda: self._resubmit(fut, fn, args, call))
+        except Exception as e:
+            fut.set_exception(e)
+        finally:
+            _dispatch_ctx.call = None
+    
+    def _resubmit(self, fut: Future, fn, args, call: CallStats):
+        try:
+            self.pool.submit(self._attempt, fut, fn, args, call)
+        except RuntimeError as e:
+            fut.set_exception(e)
+    
+    def call(self, fn, *args) -> Tuple[str, Optional[str]]:
+        return self.submit(fn, *args).result()
+    
+    def run(self, jobs, on_result, cancel: Optional[threading.Event] = None) -> int:
+        # jobs yields (fn, args, tag) and is consumed lazily; on_result(tag, status, result) fires as
+        # each call completes. Returns how many jobs were skipped because the circuit breaker opened
+        # or `cancel` was set.
+        skipped = []
+        slots = self.limiter or threading.BoundedSemaphore(self.max_pending)
+        idle = threading.Condition(self._lock)
+        
+        def done(fut, tag):
+            try:
+                if fut.cancelled():
+                    skipped.append(tag)
+                    return
+                try:
+                    st, res = fut.result()
+                except CircuitOpen:
+                    skipped.append(tag)
+                    return
+                except Exception as e:
+                    st, res = "fail", f"Error: {e}"
+                on_result(tag, st, res)
+            finally:
+                with idle:
+                    self._pending.discard(fut)
+                    if not self._pending:
+                        idle.notify_all()
+                slots.release()
+        
+        jobs = iter(jobs)
+        for fn, args, tag in jobs:
+            slots.acquire()
+            if self.client.breaker.open or (cancel and cancel.is_set()):
+                slots.release()
+                skipped.append(tag)
+                if not self.client.breaker.open:
+                    self.cancel_pending()
+                break
+            fut = self.submit(fn, *args)
+            with self._lock:
+                self._pending.add(fut)
+            fut.add_done_callback(lambda f, t=tag: done(f, t))
+        with idle:
+            while self._pending:
+                idle.wait()
+        return len(skipped) + sum(1 for _ in jobs)
+    
+    def cancel_pending(self):
+        # Coroutines queued on an AsyncSkyAPIClient fail fast on their own; cancelling them here would
+        # also abort calls that are already in flight.
+        if self.pool is None:
+            return
+        with self._lock:
+            pending = list(self._pending)
+        for fut in pending:
+            fut.cancel()
+    
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=True)
+
+class FairExecutor:
+    # Fixed worker threads shared by several Dispatchers. Each profile or job submits through its own
+    # lane. An idle worker serves the lanes with the best (lowest) priority that have work, round-robin
+    # among them, so one long plan cannot starve its peers and a short gift run overtakes a long CR.
+    def __init__(self, max_workers: int, initializer: Optional[Callable[[], None]] = None):
+        self._initializer = initializer
+        self.size = max_workers
+        self._lanes: Dict[str, deque] = {}
+        self._priority: Dict[str, int] = {}
+        self._order: deque = deque()
+        self._cv = threading.Condition()
+        self._shutdown = False
+        self._threads = [threading.Thread(target=self._work, name=f"sky-fair-{i}", daemon=True)
+                         for i in range(max_workers)]
+        for t in self._threads:
+            t.start()
+    
+    def lane(self, key: str, priority: int = 0) -> "FairLane":
+        return FairLane(self, key, priority)
+    
+    def _put(self, key: str, fn, args, priority: int = 0):
+        with self._cv:
+            if self._shutdown:
+                raise RuntimeError("cannot schedule new futures after shutdown")
+            if key not in self._lanes:
+                self._lanes[key] = deque()
+                self._priority[key] = priority
+                self._order.append(key)
+            self._lanes[key].append((fn, args))
+            self._cv.notify()
+    
+    def _take(self):
+        with self._cv:
+            while True:
+                best = None
+                for key in self._order:
+                    if self._lanes[key] and (best is None or self._priority[key] < self._priority[best]):
+                        best = key
+                if best is not None:
+                    # The served lane goes to the back so its peers at the same priority come first
+                    self._order.remove(best)
+                    self._order.append(best)
+                    return self._lanes[best].popleft()
+                if self._shutdown:
+                    return None
+                self._cv.wait()
+    
+    def _work(self):
+        if self._initializer:
+            self._initializer()
+        while True:
+            task = self._take()
+            if task is None:
+                return
+            fn, args = task
+            try:
+                fn(*args)
+            except Exception:
+                logging.exception("Shared worker task failed")
+    
+    def _drop(self, key: str):
+        with self._cv:
+            if key in self._lanes and not self._lanes[key]:
+                del self._lanes[key]
+                del self._priority[key]
+                self._order.remove(key)
+    
+    @property
+    def idle(self) -> bool:
+        with self._cv:
+            return not self._lanes
+    
+    def shutdown(self, wait: bool = True):
+        with self._cv:
+            self._shutdown = True
+            self._cv.notify_all()
+        if wait:
+            for t in self._threads:
+                t.join()
+
+class FairLane:
+    # The pool a Dispatcher sees for one profile or job; shutting a lane down only forgets the lane and
+    # leaves the shared workers running
+    def __init__(self, executor: FairExecutor, key: str, priority: int = 0):
+        self.executor = executor
+        self.key = key
+        self.priority = priority
+    
+    def submit(self, fn, *args):
+        self.executor._put(self.key, fn, args, self.priority)
+    
+    def shutdown(self, wait: bool = True):
+        self.executor._drop(self.key)
+
+class FileManager:
+    @staticmethod
+    def load_json(path: str, default=None, strict: bool = False):
+        # strict=True raises OSError/ValueError for an unreadable file instead of logging it and
+        # returning `default`; a missing file is never an error
+        if default is None:
+            default = []
+        if not os.path.exists(path):
+            return default
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            if strict:
+                raise
+            logging.error(f"Cannot load {path}: {e}")
+            return default
+    
+    @staticmethod
+    def save_json(path: str, data):
+        # Written to a sibling temp file and swapped in, so an interrupted save never leaves a torn file
+        tmp = path + ".tmp"
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(data, f, indent=4, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, path)
+            return True
+        except (OSError, TypeError, ValueError) as e:
+            logging.error(f"Cannot save {path}: {e}")
+            return False
+
+class StoreError(Exception):
+    pass
+
+class JsonRoster:
+    # Legacy backend: the whole list is one JSON file, rewritten atomically on every change. A file
+    # that failed to load is never overwritten.
+    def __init__(self, path: str):
+        self.path = path
+        self._items: Optional[List[Dict]] = None
+    
+    def load(self) -> List[Dict]:
+        self._items = None
+        try:
+            items = FileManager.load_json(self.path, [], strict=True)
+        except (OSError, ValueError) as e:
+            raise StoreError(f"{os.path.basename(self.path)}: {e}") from e
+        self._items = [i for i in items if isinstance(i, dict) and i.get('user_id')]
+        return list(self._items)
+    
+    def _save(self, items: List[Dict]) -> bool:
+        if self._items is None:
+            logging.error(f"{os.path.basename(self.path)} was not loaded; refusing to overwrite it")
+            return False
+        if not FileManager.save_json(self.path, items):
+            return False
+        self._items = items
+        return True
+    
+    def add(self, item: Dict) -> bool:
+        return self._save((self._items or []) + [item])
+    
+    def remove(self, user_ids: Iterable[str]) -> bool:
+        ids = set(user_ids)
+        return self._save([i for i in self._items or [] if i['user_id'] not in ids])
+
+class JsonStore:
+    def __init__(self):
+        self.users = JsonRoster(FILES['users'])
+        self.targets = JsonRoster(FILES['targets'])
+        self.errors: List[str] = []
+    
+    def close(self):
+        pass
+
+class SqliteRoster:
+    # One table per roster: user_id is the primary key (and so indexed), the item itself is stored as
+    # JSON, and rowid keeps insertion order. Every add/remove is its own transaction.
+    def __init__(self, store: "SqliteStore", table: str):
+        self.store = store
+        self.table = table
+    
+    def load(self) -> List[Dict]:
+        try:
+            with self.store.lock:
+                rows = self.store.conn.execute(f"SELECT data FROM {self.table} ORDER BY rowid").fetchall()
+            return [json.loads(data) for (data,) in rows]
+        except (sqlite3.Error, ValueError) as e:
+            raise StoreError(f"{self.table}: {e}") from e
+    
+    def get(self, user_id: str) -> Optional[Dict]:
+        with self.store.lock:
+            row = self.store.conn.execute(f"SELECT data FROM {self.table} WHERE user_id = ?", (user_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+    
+    def add(self, item: Dict) -> bool:
+        try:
+            with self.store.lock, self.store.conn:
+                self.store.conn.execute(f"INSERT INTO {self.table} (user_id, data) VALUES (?, ?)",
+                                        (item['user_id'], json.dumps(item, ensure_ascii=False)))
+            return True
+        except sqlite3.Error as e:
+            logging.error(f"Cannot add {item['user_id']} to {self.table}: {e}")
+            return False
+    
+    def remove(self, user_ids: Iterable[str]) -> bool:
+        try:
+            with self.store.lock, self.store.conn:
+                self.store.conn.executemany(f"DELETE FROM {self.table} WHERE user_id = ?", ((u,) for u in user_ids))
+            return True
+        except sqlite3.Error as e:
+            logging.error(f"Cannot remove from {self.table}: {e}")
+            return False
+
+class SqliteStore:
+    # users and targets in one SQLite file. On first open each table is filled once from its JSON file
+    # (left in place as a backup); a failed migration is reported in `errors` and retried next open.
+    TABLES = ('users', 'targets')
+    
+    def __init__(self, path: str):
+        self.conn = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        self.lock = Lock()
+        self.errors: List[str] = []
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        with self.conn:
+            for table in self.TABLES:
+                self.conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (user_id TEXT PRIMARY KEY, data TEXT NOT NULL)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        for table in self.TABLES:
+            if self.conn.execute("SELECT 1 FROM meta WHERE key = ?", (f"migrated:{table}",)).fetchone():
+                continue
+            try:
+                self.import_json(table)
+            except (OSError, ValueError, sqlite3.Error) as e:
+                self.errors.append(f"Migrating {os.path.basename(FILES[table])} failed: {e}")
+        self.users = SqliteRoster(self, 'users')
+        self.targets = SqliteRoster(self, 'targets')
+    
+    def import_json(self, table: str, overwrite: bool = False) -> int:
+        # Existing rows win unless overwrite=True, which updates them in place (keeping their order)
+        items = FileManager.load_json(FILES[table], [], strict=True)
+        rows = [(i['user_id'], json.dumps(i, ensure_ascii=False)) for i in items if isinstance(i, dict) and i.get('user_id')]
+        conflict = "DO UPDATE SET data = excluded.data" if overwrite else "DO NOTHING"
+        with self.lock, self.conn:
+            self.conn.executemany(f"INSERT INTO {table} (user_id, data) VALUES (?, ?) ON CONFLICT(user_id) {conflict}", rows)
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                              (f"migrated:{table}", time.strftime('%Y-%m-%dT%H:%M:%S')))
+        return len(rows)
+    
+    def export_json(self, table: str) -> bool:
+        return FileManager.save_json(FILES[table], getattr(self, table).load())
+    
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+def open_store(config: Dict):
+    if config.get('store') == 'json':
+        return JsonStore()
+    return SqliteStore(FILES['store'])
+
+def open_text(path: str):
+    # Plan files may be gzip-compressed; detected by magic bytes rather than extension
+    with open(path, 'rb') as f:
+        gz = f.read(2) == b'\x1f\x8b'
+    return gzip.open(path, 'rt', encoding='utf-8') if gz else open(path, 'r', encoding='utf-8')
+
+def iter_plan(path: str) -> Iterator[Dict]:
+    # Lazily parses a JSONL plan, one {"level_id", "pickup_ids"} record at a time
+    with open_text(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                data = json.loads(line)
+            except ValueError:
+                logging.warning(f"Skipping malformed plan line: {line[:60]}")
+                continue
+            if data.get("level_id") and data.get("pickup_ids"):
+                yield data
+
+class PickupPlanCompiler:
+    # Lines in pickup_data.json repeat levels and pickup ids; the compiled plan merges them per level
+    # and is cached next to the source as JSONL (header line + one batch per line), keyed by the
+    # source's mtime and sha256, so a cache hit streams batches without loading the whole plan.
+    # Concurrent runs check and rebuild the cache one at a time.
+    _lock = Lock()
+    
+    @staticmethod
+    def stream(path: str, batch_size: int, compile_plan: bool = True,
+               cache_path: Optional[str] = None) -> Tuple[Optional[Dict], Iterator[Dict]]:
+        # Returns (header, batches); header holds "batches"/"pickups" counts, or is None when the
+        # source is streamed uncompiled and its size is not known up front
+        if not compile_plan:
+            return None, PickupPlanCompiler._split(iter_plan(path), batch_size)
+        cache_path = cache_path or FILES['pickup_plan']
+        with PickupPlanCompiler._lock:
+            st = os.stat(path)
+            header = PickupPlanCompiler._read_header(cache_path)
+            if header and header.get('batch_size') == batch_size:
+                if header.get('source_mtime') == st.st_mtime_ns and header.get('source_size') == st.st_size:
+                    return header, PickupPlanCompiler._cached(path, batch_size, cache_path, header['batches'])
+                digest = PickupPlanCompiler._digest(path)
+                if header.get('source_sha256') == digest:
+                    header.update(source_mtime=st.st_mtime_ns, source_size=st.st_size)
+                    if PickupPlanCompiler._write(cache_path, header, PickupPlanCompiler._read_batches(cache_path)):
+                        return header, PickupPlanCompiler._cached(path, batch_size, cache_path, header['batches'])
+            else:
+                digest = PickupPlanCompiler._digest(path)
+            header, plan = PickupPlanCompiler._recompile(path, batch_size, cache_path, st, digest)
+            return header, iter(plan)
+    
+    @staticmethod
+    def _recompile(path: str, batch_size: int, cache_path: str, st: Optional[os.stat_result] = None,
+                   digest: Optional[str] = None) -> Tuple[Dict, List[Dict]]:
+        st = st or os.stat(path)
+        plan = PickupPlanCompiler.compile(path, batch_size)
+        header = {'source_mtime': st.st_mtime_ns, 'source_size': st.st_size,
+                  'source_sha256': digest or PickupPlanCompiler._digest(path), 'batch_size': batch_size,
+                  'batches': len(plan), 'pickups': sum(len(b['pickup_ids']) for b in plan)}
+        PickupPlanCompiler._write(cache_path, header, plan)
+        return header, plan
+    
+    @staticmethod
+    def _cached(path: str, batch_size: int, cache_path: str, expected: int) -> Iterator[Dict]:
+        # Streams a cache hit. A line that does not parse, or a cache cut short, rebuilds the plan from
+        # the source and carries on from the same batch instead of failing the run.
+        n = 0
+        try:
+            for batch in PickupPlanCompiler._read_batches(cache_path):
+                yield batch
+                n += 1
+            if n == expected:
+                return
+            logging.warning(f"Plan cache ended after {n} of {expected} batch(es); recompiling")
+        except (OSError, ValueError) as e:
+            logging.warning(f"Plan cache unreadable at batch {n + 1} ({e}); recompiling")
+        with PickupPlanCompiler._lock:
+            _, plan = PickupPlanCompiler._recompile(path, batch_size, cache_path)
+        yield from plan[n:]
+
+    @staticmethod
+    def compile(path: str, batch_size: int) -> List[Dict]:
+        # Memory grows with the number of distinct (level, pickup) pairs, not with the line count
+        levels: Dict = {}
+        for data in iter_plan(path):
+            levels.setdefault(data["level_id"], {}).update(dict.fromkeys(data["pickup_ids"]))
+        return list(PickupPlanCompiler._split(({"level_id": lid, "pickup_ids": list(pids)} for lid, pids in levels.items()), batch_size))
+
+    @staticmethod
+    def _split(records: Iterable[Dict], batch_size: int) -> Iterator[Dict]:
+        batch_size = max(1, int(batch_size))
+        for r in records:
+            pids = r["pickup_ids"]
+            for i in range(0, len(pids), batch_size):
+                yield {"level_id": r["level_id"], "pickup_ids": pids[i:i + batch_size]}
+
+    @staticmethod
+    def _read_header(cache_path: str) -> Optional[Dict]:
+        try:
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                header = json.loads(f.readline())
+            return header if isinstance(header, dict) and 'batches' in header else None
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _read_batches(cache_path: str) -> Iterator[Dict]:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            f.readline()
+            for line in f:
+                batch = json.loads(line)
+                if not isinstance(batch, dict) or not batch.get("level_id") or not batch.get("pickup_ids"):
+                    raise ValueError(f"bad batch record: {line[:60]!r}")
+                yield batch
+
+    @staticmethod
+    def _write(cache_path: str, header: Dict, batches: Iterable[Dict]) -> bool:
+        # Each writer gets its own temp file next to the cache, so a failed or concurrent write never
+        # leaves a half-written plan behind
+        try:
+            fd, tmp = tempfile.mkstemp(prefix=os.path.basename(cache_path) + ".", suffix=".tmp",
+                                       dir=os.path.dirname(cache_path) or ".")
+        except OSError as e:
+            logging.warning(f"Could not write plan cache: {e}")
+            return False
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(json.dumps(header) + "\n")
+                for b in batches:
+                    f.write(json.dumps(b) + "\n")
+            os.replace(tmp, cache_path)
+            return True
+        except (OSError, ValueError) as e:
+            logging.warning(f"Could not write plan cache: {e}")
+            return False
+        finally:
+            with contextlib.suppress(OSError):
+                os.remove(tmp)
+
+    @staticmethod
+    def _digest(path: str) -> str:
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 16), b''):
+                h.update(chunk)
+        return h.hexdigest()
+
+class RunJournal:
+    # Append-only JSONL of confirmed work, one {"user_id", "item", "ts"} per line, so a crashed or
+    # aborted run can resume where it stopped. A run that completes clears its own entries; the TTL
+    # only bounds how long an interrupted run's checkpoints are honoured.
+    def __init__(self, path: str, ttl_hours: float = 12, flush_every: int = 50, flush_interval: float = 1.0):
+        self.path = path
+        self.ttl = ttl_hours * 3600
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self._done = {}
+        self._buf = []
+        self._last_flush = time.monotonic()
+        self._lock = Lock()
+        self._load()
+    
+    @staticmethod
+    def pickup_key(batch: Dict) -> str:
+        ids = ",".join(map(str, sorted(batch["pickup_ids"])))
+        return f"pickup:{batch['level_id']}:{hashlib.sha1(ids.encode()).hexdigest()[:16]}"
+    
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        cutoff = time.time() - self.ttl
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                # Lines that are not a complete record (torn writes, hand edits) are skipped
+                try:
+                    e = json.loads(line)
+                    ts = float(e.get('ts', 0))
+                    if ts >= cutoff:
+                        self._done[(e['user_id'], e['item'])] = ts
+                except (ValueError, TypeError, KeyError, AttributeError):
+                    continue
+    
+    def done(self, user_id: str, item: str) -> bool:
+        ts = self._done.get((user_id, item))
+        return ts is not None and ts >= time.time() - self.ttl
+    
+    def record(self, user_id: str, item: str):
+        ts = time.time()
+        with self._lock:
+            self._done[(user_id, item)] = ts
+            self._buf.append(json.dumps({"user_id": user_id, "item": item, "ts": round(ts, 3)}) + "\n")
+            if len(self._buf) >= self.flush_every or time.monotonic() - self._last_flush >= self.flush_interval:
+                self._flush_locked()
+    
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+    
+    def _flush_locked(self):
+        self._last_flush = time.monotonic()
+        if not self._buf:
+            return
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write("".join(self._buf))
+            f.flush()
+            os.fsync(f.fileno())
+        self._buf.clear()
+    
+    def reset(self, user_id: Optional[str] = None, prefixes: Tuple[str, ...] = ()) -> int:
+        # Drops every entry, or one user's, optionally only items starting with one of `prefixes`
+        def drop(key) -> bool:
+            return (user_id is None or key[0] == user_id) and (not prefixes or key[1].startswith(prefixes))
+        with self._lock:
+            before = len(self._done)
+            if not any(drop(k) for k in self._done):
+                return 0
+            self._buf.clear()
+            self._done = {k: v for k, v in self._done.items() if not drop(k)}
+            self._rewrite_locked()
+            return before - len(self._done)
+    
+    def compact(self) -> int:
+        # Rewrites the file with one line per live entry, dropping expired and superseded records
+        with self._lock:
+            self._flush_locked()
+            cutoff = time.time() - self.ttl
+            self._done = {k: v for k, v in self._done.items() if v >= cutoff}
+            self._rewrite_locked()
+            return len(self._done)
+    
+    def _rewrite_locked(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            for (uid, item), ts in self._done.items():
+                f.write(json.dumps({"user_id": uid, "item": item, "ts": round(ts, 3)}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+def _profiled(method):
+    # Runs a Runner.run_* method under a RunProfiler when profile_dir is set; with it unset (or when a
+    # ProfileScheduler already profiles the whole batch) the method is called directly.
+    @functools.wraps(method)
+    def run(self, *args, **kwargs):
+        if self.profiler or not self.config.get('profile_dir'):
+            return method(self, *args, **kwargs)
+        kind = method.__name__[len("run_"):]
+        self.profiler = RunProfiler(self.config['profile_dir'], self._run_name(kind), self.config['profile_top'])
+        try:
+            with self.profiler:
+                return method(self, *args, **kwargs)
+        finally:
+            prof, self.profiler = self.profiler, None
+            if prof.paths:
+                self.log(f"Profile written to {prof.paths[1]}" + (" (+ .prof)" if prof.paths[0] else ""), "info")
+            else:
+                self.log(f"Profile export failed: {prof.error}", "warning")
+    return run
+
+class Runner:
+    # GUI-free orchestration of CR, quest and gift runs. log(msg, lvl) and progress(done, total) are
+    # called from worker threads; each run returns {"ok", "failed", "skipped", "aborted"}.
+    def __init__(self, config: Dict, journal: Optional[RunJournal] = None,
+                 log: Optional[Callable[[str, str], None]] = None,
+                 progress: Optional[Callable[[int, int], None]] = None,
+                 pool: Optional[FairLane] = None, label: str = '', profiler: Optional[RunProfiler] = None,
+                 cancel: Optional[threading.Event] = None):
+        self.config = config
+        self.journal = journal or RunJournal(FILES['journal'], config['journal_ttl_hours'])
+        self.log = log or console_log
+        self.progress = progress or (lambda done, total: None)
+        self.pool = pool
+        self.label = label
+        self.metrics: Optional[Metrics] = None
+        self.limiter: Optional[AdaptiveLimit] = None
+        self.profiler = profiler
+        self.cancel = cancel
+        self._prog_lock = Lock()
+        self._prog_count = self._prog_total = 0
+    
+    def _progress_reset(self, total: int):
+        with self._prog_lock:
+            self._prog_count, self._prog_total = 0, total
+        self.progress(0, total)
+    
+    def _progress_step(self):
+        with self._prog_lock:
+            self._prog_count += 1
+            done, total = self._prog_count, self._prog_total
+        self.progress(done, total)
+    
+    def _open_client(self, sid: str, uid: str):
+        try:
+            client = TRANSPORTS.acquire(sid, uid, self.config)
+        except ImportError as e:
+            self.log(f"Transport '{self.config['transport']}' unavailable: {e}", "error")
+            return None, None
+        self.metrics = client.metrics
+        disp = Dispatcher(client, self.config['max_workers'], self.pool, self.profiler.thread_init if self.profiler else None)
+        self.limiter = disp.limiter
+        return client, disp
+    
+    def _close(self, kind: str, client: SkyAPIClient, disp: Dispatcher):
+        self.journal.flush()
+        disp.close()
+        if self.profiler and client.owns_loop:
+            # The client's loop thread outlives the run (TRANSPORTS keeps it warm); stop profiling it
+            client.loop.call_soon_threadsafe(sys.setprofile, None)
+        TRANSPORTS.release(client)
+        if self.config['metrics_dir']:
+            try:
+                json_path, _ = client.metrics.export(self.config['metrics_dir'], self._run_name(kind))
+                self.log(f"Metrics written to {json_path} (+ .csv)", "info")
+            except OSError as e:
+                self.log(f"Metrics export failed: {e}", "warning")
+    
+    def _run_name(self, kind: str) -> str:
+        return "-".join(filter(None, (kind, self.label, time.strftime('%Y%m%d-%H%M%S'))))
+    
+    def _finish(self, client: SkyAPIClient, stats: Dict, skipped: int, msg: str, uid: str = '',
+                journaled: Tuple[str, ...] = ()) -> Dict:
+        # journaled: item prefixes this run checkpoints; they are cleared once it completes
+        stats['skipped'] = skipped
+        if client.breaker.open:
+            stats['aborted'] = client.breaker.reason
+            self.log(f"Run aborted: {client.breaker.reason}; {skipped} request(s) skipped", "error")
+        elif self.cancel and self.cancel.is_set():
+            stats['aborted'] = "Cancelled"
+            self.log(f"Run cancelled; {skipped} request(s) skipped", "warning")
+        else:
+            if journaled:
+                self.journal.reset(uid, journaled)
+            self.log(msg, "success")
+        return stats
+    
+    @staticmethod
+    def _new_stats() -> Dict:
+        return {"ok": 0, "failed": 0, "skipped": 0, "aborted": None}
+    
+    @_profiled
+    def run_cr(self, sid: str, uid: str, pickup_path: Optional[str] = None) -> Dict:
+        pickup_path = pickup_path or FILES['pickup']
+        stats = self._new_stats()
+        self.log("Starting CR...", "info")
+        if not os.path.exists(pickup_path) and os.path.exists(pickup_path + ".gz"):
+            pickup_path += ".gz"
+        if not os.path.exists(pickup_path):
+            self.log(f"{os.path.basename(pickup_path)} not found", "error")
+            return stats
+        
+        client, disp = self._open_client(sid, uid)
+        if not client:
+            return stats
+        try:
+            header, plan = PickupPlanCompiler.stream(pickup_path, self.config['pickup_batch_size'], self.config['pickup_compile'])
+            if header:
+                self.log(f"Plan: {header['batches']} batch(es), {header['pickups']} pickup(s)", "info")
+            else:
+                self.log("Plan: streaming uncompiled", "info")
+            self._progress_reset(header['batches'] if header else 0)
+            resumed = [0]
+            lock = Lock()
+            
+            def todo():
+                # Journaled batches count towards progress but are never submitted
+                for b in plan:
+                    if self.journal.done(uid, RunJournal.pickup_key(b)):
+                        resumed[0] += 1
+                        self._progress_step()
+                        continue
+                    yield client.collect_pickup_batch, (b["level_id"], b["pickup_ids"]), b
+            
+            def done(batch, st, res):
+                if st == "success":
+                    self.journal.record(uid, RunJournal.pickup_key(batch))
+                # Done-callbacks run on the pool threads concurrently
+                with lock:
+                    stats["ok" if st == "success" else "failed"] += 1
+                self.log(f"Level {batch['level_id']}: {res}", "success" if st == "success" else "error")
+                self._progress_step()
+            
+            skipped = disp.run(todo(), done, self.cancel)
+            if resumed[0]:
+                self.log(f"Resumed: {resumed[0]} batch(es) were already done", "info")
+            return self._finish(client, stats, skipped, "CR complete", uid, ("pickup:",))
+        except Exception as e:
+            self.log(f"CR error: {e}", "error")
+            return stats
+        finally:
+            self._close("cr", client, disp)
+    
+    @_profiled
+    def run_quest(self, sid: str, uid: str) -> Dict:
+        stats = self._new_stats()
+        self.log("Starting quests...", "info")
+        quests = FileManager.load_json(FILES['questname'], [])
+        collectibles = FileManager.load_json(FILES['collectible'], [])
+        if not quests and not collectibles:
+            self.log("No quests/collectibles", "error")
+            return stats
+        
+        client, disp = self._open_client(sid, uid)
+        if not client:
+            return stats
+        try:
+            snap = QUEST_SNAPSHOTS.get(uid, self.config['quest_snapshot_ttl'])
+            if snap:
+                self.log(f"Pre-process: reusing snapshot from {time.monotonic() - snap.taken:.0f}s ago", "info")
+            else:
+                st, res = disp.call(client.get_account_world_quests)
+                if st != "success":
+                    self.log(f"Pre-process failed: {res}", "error")
+                    stats['aborted'] = client.breaker.reason or res
+                    return stats
+                snap = QuestIndex(res)
+                QUEST_SNAPSHOTS.put(uid, snap)
+                self.log("Pre-process OK", "success")
+            
+            # Claims and collectibles only depend on the pre-step, so both lists fan out together
+            quests = [q for q in dict.fromkeys(quests) if not self.journal.done(uid, f"quest:{q}")]
+            if snap.covers(quests):
+                todo = [q for q in quests if snap.actionable(q)]
+                self.log(f"Snapshot: {len(quests) - len(todo)} quest(s) already claimed or not offered", "info")
+                quests = todo
+            elif quests:
+                self.log("Snapshot lists none of the planned quests; sending all of them", "info")
+            collectibles = [c for c in dict.fromkeys(collectibles) if not self.journal.done(uid, f"collectible:{c}")]
+            self._progress_reset(len(quests) + len(collectibles))
+            jobs = [(client.claim_quest_reward, (q,), ("Quest", q)) for q in quests]
+            jobs += [(client.collect_collectible, (c,), ("Collectible", c)) for c in collectibles]
+            lock = Lock()
+            
+            def done(tag, st, res):
+                if st == "success":
+                    self.journal.record(uid, f"{tag[0].lower()}:{tag[1]}")
+                    if tag[0] == "Quest":
+                        snap.mark_claimed(tag[1])
+                with lock:
+                    stats["ok" if st == "success" else "failed"] += 1
+                self.log(f"{tag[0]} '{tag[1]}': {res}", "success" if st == "success" else "error")
+                self._progress_step()
+            
+            skipped = disp.run(jobs, done, self.cancel)
+            return self._finish(client, stats, skipped, "Quest/collectible complete", uid, ("quest:", "collectible:"))
+        except Exception as e:
+            self.log(f"Quest error: {e}", "error")
+            return stats
+        finally:
+            self._close("quest", client, disp)
+    
+    @_profiled
+    def run_gifts(self, sid: str, uid: str, targets: List[Dict]) -> Dict:
+        # stats["targets"] maps each target's user_id to {"name", "Light", "Heart"}, where a gift entry is
+        # "success", "fail" or "skipped"
+        stats = self._new_stats()
+        self.log("Sending gifts...", "info")
+        unique: Dict[str, Dict] = {}
+        for t in targets:
+            unique.setdefault(t['user_id'], t)
+        if len(unique) < len(targets):
+            self.log(f"Dropped {len(targets) - len(unique)} duplicate target(s)", "warning")
+        per_target = stats['targets'] = {t_id: {"name": t['name']} for t_id, t in unique.items()}
+        client, disp = self._open_client(sid, uid)
+        if not client:
+            return stats
+        try:
+            self._progress_reset(2 * len(unique))
+            # Light and Heart are independent calls, so both kinds for every target share one job stream
+            gifts = (("Light", client.send_light), ("Heart", client.send_heart))
+            jobs = ((fn, (t['user_id'], t['name']), (kind, t)) for t in unique.values() for kind, fn in gifts)
+            replies: Dict[str, Dict[str, str]] = {}
+            lock = Lock()
+            
+            def done(tag, st, res):
+                kind, t = tag
+                with lock:
+                    entry = per_target[t['user_id']]
+                    entry[kind] = st
+                    got = replies.setdefault(t['user_id'], {})
+                    got[kind] = res
+                    stats["ok" if st == "success" else "failed"] += 1
+                    finished = len(got) == len(gifts)
+                if finished:
+                    sts = [entry[k] for k, _ in gifts]
+                    lvl = "success" if all(s == "success" for s in sts) else "error" if "success" not in sts else "warning"
+                    self.log(f"{t['name']}: " + "; ".join(f"{k} {got[k]}" for k, _ in gifts), lvl)
+                self._progress_step()
+            
+            skipped = disp.run(jobs, done, self.cancel)
+            for entry in per_target.values():
+                for k, _ in gifts:
+                    entry.setdefault(k, "skipped")
+            return self._finish(client, stats, skipped, "Gifts sent")
+        except Exception as e:
+            self.log(f"Gift error: {e}", "error")
+            return stats
+        finally:
+            self._close("gifts", client, disp)
+
+JOB_PRIORITY = {"gifts": 0, "quest": 1, "cr": 2}
+
+class Job:
+    # One queued run. state: queued -> running -> done | cancelled | failed; result() blocks for stats
+    def __init__(self, job_id: int, kind: str, sid: str, uid: str, args: Tuple, label: str,
+                 config: Optional[Dict], log: Optional[Callable[[str, str], None]],
+                 progress: Optional[Callable[[int, int], None]]):
+        self.id = job_id
+        self.kind = kind
+        self.sid = sid
+        self.uid = uid
+        self.args = args
+        self.label = label
+        self.priority = JOB_PRIORITY[kind]
+        self.config = config
+        self.key = (uid, kind, json.dumps(args, sort_keys=True, default=str))
+        self.state = "queued"
+        self.progress: Tuple[int, int] = (0, 0)
+        self.runner: Optional[Runner] = None
+        self.cancel_event = threading.Event()
+        self.future: Future = Future()
+        self._log = log
+        self._progress = progress
+    
+    @property
+    def name(self) -> str:
+        return f"#{self.id} {self.kind} {self.label or self.uid[-4:]}"
+    
+    def cancel(self):
+        self.cancel_event.set()
+    
+    def result(self, timeout: Optional[float] = None) -> Dict:
+        return self.future.result(timeout)
+
+class JobScheduler:
+    # Central queue for CR, quest and gift runs. Jobs wait in a priority heap (gifts, then quests, then
+    # CR; FIFO within a priority) and up to max_jobs run at once, but never two of the same kind for one
+    # account. Submitting a job identical to one still queued or running returns that job instead. On
+    # the threads transport every job's Dispatcher is a lane of one shared FairExecutor with the job's
+    # priority, so a gift run's requests go ahead of a running CR's.
+    def __init__(self, config: Dict, journal: Optional[RunJournal] = None,
+                 log: Optional[Callable[[str, str], None]] = None,
+                 progress: Optional[Callable[[int, int], None]] = None,
+                 max_jobs: Optional[int] = None, profiler: Optional[RunProfiler] = None):
+        self.config = config
+        self.journal = journal or RunJournal(FILES['journal'], config['journal_ttl_hours'])
+        self.log = log or console_log
+        self.progress = progress or (lambda done, total: None)
+        self.max_jobs = max_jobs or config['max_jobs']
+        self.profiler = profiler
+        self.last_runner: Optional[Runner] = None
+        self._heap: List[Tuple[int, int, Job]] = []
+        self._seq = itertools.count()
+        self._ids = itertools.count(1)
+        self._jobs: Dict[int, Job] = {}
+        self._period: Dict[int, Job] = {}
+        self._busy: set = set()
+        self._cv = threading.Condition()
+        self._threads: List[threading.Thread] = []
+        self._pool: Optional[FairExecutor] = None
+        self._shutdown = False
+    
+    def submit(self, kind: str, sid: str, uid: str, args: Tuple = (), label: str = '', config: Optional[Dict] = None,
+               log: Optional[Callable[[str, str], None]] = None,
+               progress: Optional[Callable[[int, int], None]] = None) -> Job:
+        job = Job(0, kind, sid, uid, args, label, config, log, progress)
+        with self._cv:
+            for other in self._jobs.values():
+                if other.key == job.key and not other.cancel_event.is_set():
+                    merged = other
+                    break
+            else:
+                merged = None
+                job.id = next(self._ids)
+                if not self._jobs:
+                    self._period.clear()
+                self._jobs[job.id] = self._period[job.id] = job
+                heapq.heappush(self._heap, (job.priority, next(self._seq), job))
+                if len(self._threads) < self.max_jobs:
+                    t = threading.Thread(target=self._work, name=f"sky-job-{len(self._threads)}", daemon=True)
+                    self._threads.append(t)
+                    t.start()
+                self._cv.notify()
+        if merged:
+            self.log(f"{merged.name} is already {merged.state}; merged", "info")
+            return merged
+        self.log(f"{job.name} queued", "info")
+        return job
+    
+    def jobs(self) -> List[Job]:
+        with self._cv:
+            return sorted(self._jobs.values(), key=lambda j: j.id)
+    
+    def cancel_all(self) -> int:
+        with self._cv:
+            jobs = list(self._jobs.values())
+            for job in jobs:
+                job.cancel()
+            self._cv.notify_all()
+        return len(jobs)
+    
+    def shutdown(self):
+        self.cancel_all()
+        with self._cv:
+            self._shutdown = True
+            self._cv.notify_all()
+        for t in self._threads:
+            t.join()
+        if self._pool:
+            self._pool.shutdown(wait=True)
+    
+    def _next(self) -> Optional[Job]:
+        # Highest-priority job with no job of its kind running for its account; cancelled queued jobs
+        # are settled on the way
+        deferred, found = [], None
+        while self._heap:
+            entry = heapq.heappop(self._heap)
+            job = entry[2]
+            if job.cancel_event.is_set():
+                job.state = "cancelled"
+                del self._jobs[job.id]
+                job.future.set_result({**Runner._new_stats(), 'aborted': "Cancelled"})
+            elif (job.uid, job.kind) in self._busy:
+                deferred.append(entry)
+            else:
+                found = job
+                break
+        for entry in deferred:
+            heapq.heappush(self._heap, entry)
+        return found
+    
+    def _work(self):
+        if self.profiler:
+            self.profiler.thread_init()
+        while True:
+            with self._cv:
+                job = self._next()
+                while job is None and not self._shutdown:
+                    self._cv.wait()
+                    job = self._next()
+                if job is None:
+                    return
+                job.state = "running"
+                self._busy.add((job.uid, job.kind))
+            try:
+                self._run(job)
+            finally:
+                with self._cv:
+                    self._busy.discard((job.uid, job.kind))
+                    del self._jobs[job.id]
+                    self._cv.notify_all()
+    
+    def _shared_pool(self, cfg: Dict) -> FairExecutor:
+        with self._cv:
+            if self._pool and self._pool.size != cfg['max_workers'] and self._pool.idle:
+                self._pool.shutdown(wait=False)
+                self._pool = None
+            if self._pool is None:
+                self._pool = FairExecutor(cfg['max_workers'], self.profiler.thread_init if self.profiler else None)
+            return self._pool
+    
+    def _job_progress(self, job: Job):
+        def update(done: int, total: int):
+            job.progress = (done, total)
+            if job._progress:
+                job._progress(done, total)
+            with self._cv:
+                done, total = (sum(v) for v in zip(*(j.progress for j in self._period.values())))
+            self.progress(done, total)
+        return update
+    
+    def _run(self, job: Job):
+        cfg = job.config or self.config
+        # A run profiled on its own needs private workers so the profiler can hook them
+        private = cfg['transport'] == 'asyncio' or (cfg.get('profile_dir') and not self.profiler)
+        log = job._log or (lambda msg, lvl="info": self.log(f"[{job.name}] {msg}", lvl))
+        runner = Runner(cfg, self.journal, log=log, progress=self._job_progress(job),
+                        pool=None if private else self._shared_pool(cfg).lane(f"job-{job.id}", job.priority),
+                        label=job.label, profiler=self.profiler, cancel=job.cancel_event)
+        job.runner = self.last_runner = runner
+        try:
+            stats = getattr(runner, f"run_{job.kind}")(job.sid, job.uid, *job.args)
+        except Exception as e:
+            job.state = "failed"
+            self.log(f"[{job.name}] failed: {e}", "error")
+            job.future.set_exception(e)
+            return
+        job.state = "cancelled" if job.cancel_event.is_set() else "done"
+        job.future.set_result(stats)
+
+class ProfileScheduler:
+    # Runs one CR or quest plan for several users.json profiles at once, as one job per profile on a
+    # JobScheduler: each profile gets its own client, journal keys and stats, and on the threads
+    # transport they all share its FairExecutor. asyncio clients each own a loop, so max_in_flight is
+    # split between them. Without a shared `jobs` scheduler a private one runs every profile at once.
+    def __init__(self, config: Dict, journal: Optional[RunJournal] = None,
+                 log: Optional[Callable[[str, str], None]] = None,
+                 progress: Optional[Callable[[int, int], None]] = None,
+                 jobs: Optional[JobScheduler] = None):
+        self.config = config
+        self.journal = journal or RunJournal(FILES['journal'], config['journal_ttl_hours'])
+        self.log = log or console_log
+        self.progress = progress or (lambda done, total: None)
+        self.jobs = jobs
+        self._prog: Dict[str, Tuple[int, int]] = {}
+        self._prog_lock = Lock()
+    
+    @staticmethod
+    def load_profiles(users: List[Dict], names: Optional[Iterable[str]] = None) -> List[Dict]:
+        users = [u for u in users if isinstance(u, dict) and u.get('user_id')]
+        if names:
+            wanted = set(names)
+            users = [u for u in users if u.get('nickname') in wanted or u['user_id'] in wanted]
+        return users
+    
+    @staticmethod
+    def profile_session(profile: Dict) -> str:
+        # Profiles carry either "session" or "session_file" (relative paths resolve against BASE_DIR)
+        if profile.get('session'):
+            return str(profile['session']).strip()
+        if profile.get('session_file'):
+            with open(os.path.join(BASE_DIR, profile['session_file']), 'r', encoding='utf-8') as f:
+                return f.read().strip()
+        return ''
+    
+    def _profile_log(self, name: str):
+        return lambda msg, lvl="info": self.log(f"[{name}] {msg}", lvl)
+    
+    def _profile_progress(self, name: str):
+        def update(done: int, total: int):
+            with self._prog_lock:
+                self._prog[name] = (done, total)
+                done, total = (sum(v) for v in zip(*self._prog.values()))
+            self.progress(done, total)
+        return update
+    
+    def run(self, kind: str, profiles: List[Dict]) -> Dict[str, Dict]:
+        if kind not in ("cr", "quest"):
+            raise ValueError(f"unsupported batch run: {kind}")
+        todo = []
+        for p in profiles:
+            name = p.get('nickname') or p['user_id']
+            try:
+                sid = self.profile_session(p)
+            except OSError as e:
+                self.log(f"[{name}] Cannot read session: {e}", "error")
+                continue
+            if not sid:
+                self.log(f"[{name}] No session or session_file; skipped", "warning")
+                continue
+            todo.append((name, p['user_id'], sid))
+        if not todo:
+            self.log("No profiles with a session to run", "error")
+            return {}
+        
+        cfg = dict(self.config)
+        if cfg['transport'] == 'asyncio':
+            cfg['max_in_flight'] = max(1, cfg['max_in_flight'] // len(todo))
+        if kind == "cr" and cfg['pickup_compile']:
+            # Compile once up front so the profiles hit the plan cache instead of racing to write it
+            path = FILES['pickup'] if os.path.exists(FILES['pickup']) else FILES['pickup'] + ".gz"
+            if os.path.exists(path):
+                PickupPlanCompiler.stream(path, cfg['pickup_batch_size'])
+        
+        self.log(f"Batch {kind}: {len(todo)} profile(s)", "info")
+        self._prog = {name: (0, 0) for name, _, _ in todo}
+        results: Dict[str, Dict] = {}
+        # A private scheduler gets one profile for the whole batch, which its workers hook into; on a
+        # shared scheduler each job profiles itself
+        profiler = None
+        if cfg['profile_dir'] and not self.jobs:
+            profiler = RunProfiler(cfg['profile_dir'], f"batch-{kind}-{time.strftime('%Y%m%d-%H%M%S')}", cfg['profile_top'])
+        with profiler or contextlib.nullcontext():
+            jobs = self.jobs or JobScheduler(cfg, self.journal, self.log, max_jobs=len(todo), profiler=profiler)
+            try:
+                submitted = [(name, jobs.submit(kind, sid, uid, label=name, config=cfg, log=self._profile_log(name),
+                                                progress=self._profile_progress(name))) for name, uid, sid in todo]
+                for name, job in submitted:
+                    try:
+                        results[name] = job.result()
+                    except Exception as e:
+                        self.log(f"[{name}] {kind} failed: {e}", "error")
+            finally:
+                if not self.jobs:
+                    jobs.shutdown()
+        if profiler:
+            if profiler.paths:
+                self.log(f"Profile written to {profiler.paths[1]}" + (" (+ .prof)" if profiler.paths[0] else ""), "info")
+            else:
+                self.log(f"Profile export failed: {profiler.error}", "warning")
+        ok = sum(s['ok'] for s in results.values())
+        failed = sum(s['failed'] for s in results.values())
+        aborted = [n for n, s in results.items() if s['aborted']]
+        self.log(f"Batch {kind} complete: {len(results)} profile(s), ok={ok} failed={failed}"
+                 + (f", aborted: {', '.join(aborted)}" if aborted else ""), "error" if aborted else "success")
+        return results
+
+LOG_PREFIXES = {"error": "[ERROR]", "success": "[✓]", "info": "[i]", "warning": "[!]"}
+
+def console_log(msg: str, lvl: str = "info"):
+    print(f"{LOG_PREFIXES.get(lvl, '[i]')} {msg}", flush=True)
+
+def _resolve_user(users: List[Dict], value: str) -> str:
+    for u in users:
+        if isinstance(u, dict) and value in (u.get('nickname'), u.get('user_id')):
+            return u['user_id']
+    return value
+
+def _read_session(args) -> str:
+    if args.session:
+        return args.session.strip()
+    if args.session_file == '-':
+        return sys.stdin.readline().strip()
+    with open(args.session_file, 'r', encoding='utf-8') as f:
+        return f.read().strip()
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="runner", description="Headless ALT Auto CR runner")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name, help_text in (("cr", "collect pickups from pickup_data.json"),
+                            ("quest", "claim world quests and collectibles"),
+                            ("gifts", "send light and hearts to targets")):
+        p = sub.add_parser(name, help=help_text)
+        p.add_argument("--user", required=True, help="nickname or user id from users.json, or a raw user id")
+        src = p.add_mutually_exclusive_group(required=True)
+        src.add_argument("--session-file", help="file holding the session id ('-' reads stdin)")
+        src.add_argument("--session", help="session id (visible in the process list; prefer --session-file)")
+        p.add_argument("--workers", type=int, help="override max_workers")
+        p.add_argument("--transport", choices=("threads", "asyncio"), help="override transport")
+        p.add_argument("--metrics-dir", help="write per-endpoint metrics (JSON + CSV) to this directory")
+        p.add_argument("--profile-dir", help="profile the run (cProfile + tracemalloc) into this directory")
+        if name == "cr":
+            p.add_argument("--pickup-file", help="pickup plan to run instead of pickup_data.json")
+        if name == "gifts":
+            p.add_argument("--target", action="append", help="target user id or name (repeatable; default: all targets)")
+    b = sub.add_parser("batch", help="run cr or quest for several users.json profiles at once")
+    b.add_argument("plan", choices=("cr", "quest"))
+    b.add_argument("--profile", action="append", help="nickname or user id (repeatable; default: every profile)")
+    b.add_argument("--workers", type=int, help="override max_workers (shared by all profiles)")
+    b.add_argument("--transport", choices=("threads", "asyncio"), help="override transport")
+    b.add_argument("--metrics-dir", help="write per-endpoint metrics (JSON + CSV) to this directory")
+    b.add_argument("--profile-dir", help="profile the whole batch (cProfile + tracemalloc) into this directory")
+    s = sub.add_parser("store", help="move users/targets between the SQLite store and the JSON files")
+    s.add_argument("action", choices=("import", "export"),
+                   help="import: upsert users.json/targets.json into the store; export: rewrite them from it")
+    j = sub.add_parser("journal", help="reset or compact the run journal")
+    j.add_argument("action", choices=("reset", "compact"))
+    j.add_argument("--user", help="only reset this user's entries")
+    args = parser.parse_args(argv)
+    
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+    config = ConfigManager.load_config()
+    try:
+        store = open_store(config)
+    except sqlite3.Error as e:
+        console_log(f"Cannot open {FILES['store']}: {e}", "error")
+        return 2
+    try:
+        return _dispatch(args, config, store)
+    finally:
+        store.close()
+        TRANSPORTS.close_all()
+
+def _dispatch(args, config: Dict, store) -> int:
+    for err in store.errors:
+        console_log(err, "warning")
+    if args.command == "store":
+        if not isinstance(store, SqliteStore):
+            console_log("config 'store' is 'json'; users.json and targets.json are already the store", "error")
+            return 2
+        for table in SqliteStore.TABLES:
+            if args.action == "import":
+                try:
+                    n = store.import_json(table, overwrite=True)
+                except (OSError, ValueError, sqlite3.Error) as e:
+                    console_log(f"Import of {table} failed: {e}", "error")
+                    return 1
+                console_log(f"Imported {n} {table}", "success")
+            elif not store.export_json(table):
+                console_log(f"Export of {table} failed", "error")
+                return 1
+            else:
+                console_log(f"Exported {table} to {os.path.basename(FILES[table])}", "success")
+        return 0
+    try:
+        users = store.users.load()
+    except StoreError as e:
+        console_log(f"Cannot load users: {e}", "error")
+        return 2
+    journal = RunJournal(FILES['journal'], config['journal_ttl_hours'])
+    if args.command == "journal":
+        if args.action == "reset":
+            n = journal.reset(_resolve_user(users, args.user) if args.user else None)
+            console_log(f"Journal reset: {n} entr{'y' if n == 1 else 'ies'} removed", "success")
+        else:
+            console_log(f"Journal compacted: {journal.compact()} live entries", "success")
+        return 0
+    
+    if args.workers:
+        config['max_workers'] = args.workers
+    if args.transport:
+        config['transport'] = args.transport
+    if args.metrics_dir:
+        config['metrics_dir'] = args.metrics_dir
+    if args.profile_dir:
+        config['profile_dir'] = args.profile_dir
+    if args.command == "batch":
+        profiles = ProfileScheduler.load_profiles(users, args.profile)
+        if not profiles:
+            console_log("No matching profiles", "error")
+            return 2
+        results = ProfileScheduler(config, journal).run(args.plan, profiles)
+        if not results:
+            return 2
+        clean = len(results) == len(profiles) and all(not s['failed'] and not s['aborted'] for s in results.values())
+        return 0 if clean else 1
+    try:
+        sid = _read_session(args)
+    except OSError as e:
+        console_log(f"Cannot read session: {e}", "error")
+        return 2
+    if not sid:
+        console_log("Session ID required", "error")
+        return 2
+    uid = _resolve_user(users, args.user)
+    runner = Runner(config, journal)
+    if args.command == "cr":
+        stats = runner.run_cr(sid, uid, args.pickup_file)
+    elif args.command == "quest":
+        stats = runner.run_quest(sid, uid)
+    else:
+        try:
+            targets = store.targets.load()
+        except StoreError as e:
+            console_log(f"Cannot load targets: {e}", "error")
+            return 2
+        if args.target:
+            targets = [t for t in targets if t['user_id'] in args.target or t['name'] in args.target]
+        if not targets:
+            console_log("No targets selected", "error")
+            return 2
+        stats = runner.run_gifts(sid, uid, targets)
+    console_log(f"ok={stats['ok']} failed={stats['failed']} skipped={stats['skipped']}", "info")
+    return 0 if not stats['failed'] and not stats['aborted'] else 1
+
+if __name__ == "__main__":
+    # async_client imports `runner`; without this alias it would load a second copy of this module whose
+    # CircuitOpen and friends are different classes from the ones Dispatcher catches here
+    sys.modules.setdefault("runner", sys.modules[__name__])
+    sys.exit(main())
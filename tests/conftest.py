@@ -0,0 +1,44 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import mock_server  # noqa: E402
+import runner  # noqa: E402
+
+@pytest.fixture
+def server():
+    srv = mock_server.serve(settings=mock_server.MockSettings(latency_ms=1, jitter_ms=0))
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+
+@pytest.fixture
+def config(server, tmp_path, monkeypatch):
+    # Default config pointed at the mock server; journal, plan cache and config.json live in tmp_path
+    monkeypatch.setitem(runner.FILES, 'config', str(tmp_path / "config.json"))
+    monkeypatch.setitem(runner.FILES, 'journal', str(tmp_path / "run_journal.jsonl"))
+    monkeypatch.setitem(runner.FILES, 'pickup_plan', str(tmp_path / "pickup_plan.cache.json"))
+    cfg = runner.ConfigManager.load_config()
+    cfg.update(base_url=server.url, max_workers=4, retry_base_delay=0.01, retry_max_delay=0.05)
+    yield cfg
+    runner.TRANSPORTS.close_all()
+    runner.QUEST_SNAPSHOTS.drop()
+
+@pytest.fixture
+def journal(tmp_path):
+    return runner.RunJournal(str(tmp_path / "journal.jsonl"))
+
+@pytest.fixture
+def logs():
+    return []
+
+@pytest.fixture
+def make_runner(config, journal, logs):
+    def make(**kwargs):
+        return runner.Runner(config, journal, log=lambda msg, lvl="info": logs.append((lvl, msg)),
+                             progress=lambda done, total: None, **kwargs)
+    return make
@@ -0,0 +1,233 @@
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+
+import pytest
+
+import runner
+from conftest import ROOT
+from runner import FILES, Dispatcher, JobScheduler, PickupPlanCompiler, RunJournal
+
+PLAN_BATCHES = 66
+PLAN_PICKUPS = 4089
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def test_plan_compiles_to_expected_batches():
+    with open(FILES['pickup'], 'r', encoding='utf-8') as f:
+        assert sum(1 for line in f if line.strip()) == 343
+    plan = PickupPlanCompiler.compile(FILES['pickup'], 100)
+    assert len(plan) == PLAN_BATCHES
+    assert sum(len(b['pickup_ids']) for b in plan) == PLAN_PICKUPS
+
+def test_plan_cache_hit_streams_same_plan(tmp_path):
+    cache = str(tmp_path / "plan.jsonl")
+    header, first = PickupPlanCompiler.stream(FILES['pickup'], 100, cache_path=cache)
+    first = list(first)
+    again, second = PickupPlanCompiler.stream(FILES['pickup'], 100, cache_path=cache)
+    assert list(second) == first
+    assert header['batches'] == again['batches'] == PLAN_BATCHES
+    assert header['pickups'] == PLAN_PICKUPS
+
+def test_concurrent_plan_compiles_share_one_cache(tmp_path):
+    cache = str(tmp_path / "plan.jsonl")
+    errors, results = [], []
+
+    def stream():
+        try:
+            header, batches = PickupPlanCompiler.stream(FILES['pickup'], 100, cache_path=cache)
+            results.append((header['batches'], sum(len(b['pickup_ids']) for b in batches)))
+        except Exception as e:
+            errors.append(e)
+
+    for _ in range(10):
+        if os.path.exists(cache):
+            os.remove(cache)
+        threads = [threading.Thread(target=stream) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    assert not errors
+    assert set(results) == {(PLAN_BATCHES, PLAN_PICKUPS)}
+    assert os.listdir(tmp_path) == ["plan.jsonl"]
+
+@pytest.mark.parametrize("damage", ["corrupt", "truncate"])
+def test_damaged_plan_cache_recompiles(tmp_path, damage):
+    cache = str(tmp_path / "plan.jsonl")
+    _, batches = PickupPlanCompiler.stream(FILES['pickup'], 100, cache_path=cache)
+    expected = list(batches)
+    with open(cache, 'r', encoding='utf-8') as f:
+        lines = f.readlines()
+    if damage == "corrupt":
+        lines[10] = '{"level_id": "x", "pickup_ids": [\n'
+    else:
+        lines = lines[:20]
+    with open(cache, 'w', encoding='utf-8') as f:
+        f.writelines(lines)
+    _, batches = PickupPlanCompiler.stream(FILES['pickup'], 100, cache_path=cache)
+    assert list(batches) == expected
+
+def test_body_templates_match_json_dumps(config):
+    client = runner.SkyAPIClient("sess", "user", dict(config, json_codec='json'))
+    sent = []
+    client._make_request = lambda endpoint, body, *args, **kwargs: sent.append(body)
+    client.collect_pickup_batch("lvl", ["a", 'b"c'])
+    client.send_light("target", "name")
+    ids = {"session": "sess", "user": "user", "user_id": "user"}
+    assert sent[0] == json.dumps({"emitters": [], "global_pickup_ids": [], "level_id": "lvl",
+                                  "pickup_ids": ["a", 'b"c'], **ids}).encode()
+    assert sent[1] == json.dumps({"gift_type": "gift_heart_wax", "session": "sess", "target": "target",
+                                  "user": "user", "user_id": "user"}).encode()
+    client.close()
+
+def test_retry_then_success(server, config):
+    server.settings.error_rate = 0.5
+    server.settings.retry_after = 0
+    config['max_retries'] = 30
+    client = runner.create_client("s", "u", config)
+    disp = Dispatcher(client, 4)
+    results = []
+    try:
+        skipped = disp.run([(client.claim_quest_reward, (f"q{i}",), i) for i in range(20)],
+                           lambda tag, st, res: results.append(st))
+    finally:
+        disp.close()
+        client.close()
+    assert skipped == 0
+    assert results == ["success"] * 20
+    assert server.counts['/account/claim_quest_reward'] > 20
+
+def test_retry_budget_exhausted(server, config):
+    server.settings.error_rate = 1.0
+    server.settings.retry_after = 0
+    client = runner.create_client("s", "u", config)
+    disp = Dispatcher(client, 1)
+    try:
+        assert disp.call(client.claim_quest_reward, "q") == ("fail", "HTTP 503")
+    finally:
+        disp.close()
+        client.close()
+    assert server.total == config['max_retries']
+
+@pytest.mark.parametrize("transport", ["threads", "asyncio"])
+def test_bad_response_body_is_retried_without_tripping_breaker(server, config, transport):
+    if transport == "asyncio":
+        pytest.importorskip("aiohttp")
+    server.settings.bad_body_rate = 1.0
+    config.update(transport=transport, breaker_threshold=2)
+    client = runner.create_client("s", "u", config)
+    disp = Dispatcher(client, 1)
+    try:
+        assert disp.call(client.claim_quest_reward, "q") == ("fail", "Bad response body")
+        assert not client.breaker.open
+        assert server.total == config['max_retries']
+        server.settings.bad_body_rate = 0.0
+        assert disp.call(client.get_account_world_quests)[0] == "success"
+    finally:
+        disp.close()
+        client.close()
+
+def test_unauthorized_trips_breaker(server, make_runner):
+    server.settings.unauthorized_after = 5
+    stats = make_runner().run_cr("s", "u")
+    assert stats['aborted'] == "Unauthorized"
+    assert stats['ok'] == 5
+    assert stats['skipped'] > 0
+    assert stats['ok'] + stats['failed'] + stats['skipped'] == PLAN_BATCHES
+    assert server.total < PLAN_BATCHES
+
+def test_aborted_run_resumes_from_journal(server, make_runner, logs):
+    server.settings.unauthorized_after = 30
+    first = make_runner().run_cr("s", "u")
+    assert first['aborted'] == "Unauthorized" and first['ok'] == 30
+    server.settings.unauthorized_after = None
+    sent = server.total
+    second = make_runner().run_cr("s", "u")
+    assert second == {"ok": PLAN_BATCHES - 30, "failed": 0, "skipped": 0, "aborted": None}
+    assert server.total - sent == PLAN_BATCHES - 30
+    assert ("info", "Resumed: 30 batch(es) were already done") in logs
+
+def test_journal_skips_lines_that_are_not_records(tmp_path):
+    path = tmp_path / "journal.jsonl"
+    good = {"user_id": "u", "item": "quest:a", "ts": time.time()}
+    lines = ["not json", "[1, 2]", "null", '{"user_id": "u"}', '{"user_id": "u", "item": "quest:b", "ts": "x"}',
+             '{"user_id": ["u"], "item": "quest:c"}',
+             json.dumps(good)]
+    path.write_text("\n".join(lines) + "\n", encoding='utf-8')
+    journal = RunJournal(str(path))
+    assert journal.done("u", "quest:a")
+    assert not journal.done("u", "quest:b")
+
+def test_completed_run_does_not_block_the_next(server, make_runner, journal):
+    assert make_runner().run_cr("s", "u")['ok'] == PLAN_BATCHES
+    assert make_runner().run_cr("s", "u")['ok'] == PLAN_BATCHES
+    assert server.counts['/account/collect_pickup_batch'] == 2 * PLAN_BATCHES
+    assert not journal.done("u", RunJournal.pickup_key(PickupPlanCompiler.compile(FILES['pickup'], 100)[0]))
+
+def test_gift_job_overtakes_running_cr_on_same_account(server, config, journal):
+    server.settings.latency_ms = 20
+    config['max_workers'] = 2
+    jobs = JobScheduler(config, journal, log=lambda msg, lvl="info": None, progress=lambda done, total: None)
+    try:
+        cr = jobs.submit("cr", "s", "u")
+        while cr.progress[0] < 5:
+            time.sleep(0.01)
+        gifts = jobs.submit("gifts", "s", "u", ([{"user_id": "t1", "name": "t"}],))
+        assert gifts.result(timeout=5)['ok'] == 2
+        assert not cr.future.done()
+        assert cr.result()['ok'] == PLAN_BATCHES
+    finally:
+        jobs.shutdown()
+
+def test_overlapping_profiled_jobs(config, journal, logs, tmp_path):
+    config['profile_dir'] = str(tmp_path / "prof")
+    jobs = JobScheduler(config, journal, log=lambda msg, lvl="info": logs.append((lvl, msg)),
+                        progress=lambda done, total: None)
+    try:
+        gifts = jobs.submit("gifts", "s", "u1", ([{"user_id": f"t{i}", "name": "t"} for i in range(3)],))
+        quest = jobs.submit("quest", "s", "u2")
+        assert gifts.result()['ok'] == 6
+        assert quest.result()['aborted'] is None
+    finally:
+        jobs.shutdown()
+    assert (gifts.state, quest.state) == ("done", "done")
+    assert not [msg for lvl, msg in logs if "Profile export failed" in msg]
+    # From Python 3.12 only one cProfile can be active, so the run that overlaps it reports allocations only
+    written = os.listdir(config['profile_dir'])
+    assert len([f for f in written if f.endswith(".txt")]) == 2
+    assert 1 <= len([f for f in written if f.endswith(".prof")]) <= 2
+    assert not tracemalloc.is_tracing()
+
+def test_warm_asyncio_client_picks_up_new_timeout(server, config):
+    pytest.importorskip("aiohttp")
+    server.settings.latency_ms = 300
+    config.update(transport="asyncio", max_retries=1)
+    client = runner.TRANSPORTS.acquire("s", "u", config)
+    assert Dispatcher(client, 1).call(client.claim_quest_reward, "q") == ("success", "ok")
+    runner.TRANSPORTS.release(client)
+    again = runner.TRANSPORTS.acquire("s", "u", dict(config, request_timeout=0.05))
+    assert again is client
+    assert Dispatcher(again, 1).call(again.claim_quest_reward, "q") == ("fail", "Timeout")
+    runner.TRANSPORTS.release(again)
+
+def test_cli_asyncio_breaker_skips_are_not_failures(tmp_path):
+    # Run as a script, runner.py is __main__; async_client must still see the same CircuitOpen class
+    pytest.importorskip("aiohttp")
+    for name in ("runner.py", "async_client.py", "pickup_data.json"):
+        shutil.copy(os.path.join(ROOT, name), tmp_path)
+    with open(tmp_path / "config.json", 'w', encoding='utf-8') as f:
+        json.dump({"base_url": f"http://127.0.0.1:{_free_port()}", "retry_base_delay": 0.01,
+                   "retry_max_delay": 0.02}, f)
+    proc = subprocess.run([sys.executable, "runner.py", "cr", "--user", "u", "--session", "s", "--transport", "asyncio"],
+                          cwd=tmp_path, capture_output=True, text=True, timeout=120)
+    assert f"ok=0 failed=0 skipped={PLAN_BATCHES}" in proc.stdout, proc.stdout + proc.stderr